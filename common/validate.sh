@@ -36,6 +36,7 @@ if $help; then
     echo "  Run it in an activated virtualenv with the current Buildbot installed, as well as"
     echo "      sphinx, flake8, mock, and so on"
     echo "To use a different directory for tests, pass TRIALTMP=/path as an env variable"
+    echo "To run the tests in several processes, pass TRIALJOBS=N as an env variable"
     echo "if --quick is passed validate will skip unit tests and concentrate on coding style"
     echo "if --no-js is passed validate will skip tests that require Node and NPM"
     echo "if --help is passed validate will output this message and exit"
@@ -116,8 +117,11 @@ run_tests() {
     else
         warning "please provide a TRIALTMP env variable pointing to a ramfs for 30x speed up of the integration tests"
     fi
+    if [ -n "${TRIALJOBS}" ]; then
+        JOBS_OPT="--jobs ${TRIALJOBS}"
+    fi
     find . -name \*.pyc -exec rm {} \;
-    trial --reporter text ${TEMP_DIRECTORY_OPT} ${TEST}
+    trial --reporter text ${TEMP_DIRECTORY_OPT} ${JOBS_OPT} ${TEST}
 }
 
 if ! git diff --no-ext-diff --quiet --exit-code; then
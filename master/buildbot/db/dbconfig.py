@@ -68,7 +68,7 @@ class DbConfig(object):
         db.state = state.StateConnectorComponent(db)
         try:
             self.objectid = db.state.thdGetObjectId(
-                db_engine, self.name, "DbConfig")['id']
+                db_engine, self.name, "DbConfig")
         except (ProgrammingError, OperationalError):
             # ProgrammingError: mysql&pg, OperationalError: sqlite
             # assume db is not initialized
@@ -15,39 +15,196 @@
 
 from __future__ import absolute_import
 from __future__ import print_function
+from future.moves.sys import intern
 
+import collections
 import json
+import threading
 
 import sqlalchemy as sa
 import sqlalchemy.exc
 
 from buildbot.db import base
 
+try:
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+except ImportError:  # pragma: no cover
+    # SQLAlchemy < 1.1
+    pg_insert = None
+
+try:
+    from sqlalchemy.dialects.mysql import insert as mysql_insert
+except ImportError:  # pragma: no cover
+    # SQLAlchemy < 1.2
+    mysql_insert = None
+
+
+# state values are encoded and decoded with json alone: orjson stores values
+# differently (accepting datetimes, storing NaN as null) and decodes integers
+# over 64 bits as floats, and scanning for those costs more than orjson saves.
+# Non-ASCII characters stay escaped, as MySQL tables use the 3-byte utf8
+# charset, which cannot hold characters such as emoji.
+_dumps = json.JSONEncoder(separators=(',', ':')).encode
+_loads = json.loads
+
+
+class _ObjectId(object):
+    # the objectids cache needs values that can be weakly referenced, which
+    # integers cannot
+    __slots__ = ('id', '__weakref__')
+
+    def __init__(self, id):
+        self.id = id
+
+
+# cached in place of a JSON value for state values known to be missing
+_MISSING_STATE = object()
+
+
+class _StateCache(object):
+    # A small thread-safe LRU cache, mapping (objectid, name) to the JSON value
+    # last read from or written to the database by this master, or to
+    # _MISSING_STATE.  The generation changes with every write, so that a
+    # value read before a write does not replace the one written.  JSON values
+    # longer than max_value_length are not kept, as they would cost more
+    # memory than skipping their writes saves.
+
+    def __init__(self, max_size, max_value_length):
+        self.max_size = max_size
+        self.max_value_length = max_value_length
+        self.values = collections.OrderedDict()
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.values.pop(key, None)
+            if value is not None:
+                self.values[key] = value
+            return value
+
+    def fill(self, key, value, generation):
+        # cache a value read from the database, unless something was written
+        # since the given generation
+        with self.lock:
+            if self.generation == generation:
+                self._put(key, value)
+
+    def _put(self, key, value):
+        self.values.pop(key, None)
+        if (value is not _MISSING_STATE and
+                len(value) > self.max_value_length):
+            return
+        self.values[key] = value
+        if len(self.values) > self.max_size:
+            self.values.popitem(last=False)
+
+    def update(self, items, generation):
+        # cache values written to the database, unless something else was
+        # written since the given generation; the order of concurrent writes
+        # is unknown, so their values are forgotten instead
+        with self.lock:
+            unchanged = self.generation == generation
+            self.generation += 1
+            for key, value in items:
+                if unchanged:
+                    self._put(key, value)
+                else:
+                    self.values.pop(key, None)
+
+    def discard(self, key):
+        with self.lock:
+            self.generation += 1
+            self.values.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.values.clear()
+
+
+# The queries run most often are built once per component, with bind
+# parameters for the values, so that their compiled form can be cached.
+
+def _selectObjectIdQuery(model):
+    objects_tbl = model.objects
+    whereclause = ((objects_tbl.c.name == sa.bindparam('q_name'))
+                   & (objects_tbl.c.class_name == sa.bindparam('q_class_name')))
+    return sa.select([objects_tbl.c.id], whereclause=whereclause)
+
 
-class _IdNotFoundError(Exception):
-    pass  # used internally
+def _insertObjectQuery(model):
+    return model.objects.insert()
 
 
-class ObjDict(dict):
-    pass
+def _stateWhereclause(object_state_tbl):
+    return ((object_state_tbl.c.objectid == sa.bindparam('q_objectid'))
+            & (object_state_tbl.c.name == sa.bindparam('q_name')))
+
+
+def _selectStateQuery(model):
+    object_state_tbl = model.object_state
+    return sa.select([object_state_tbl.c.value_json],
+                     whereclause=_stateWhereclause(object_state_tbl))
+
+
+def _updateStateQuery(model):
+    object_state_tbl = model.object_state
+    return object_state_tbl.update(
+        whereclause=_stateWhereclause(object_state_tbl))
+
+
+def _insertStateQuery(model):
+    return model.object_state.insert()
 
 
 class StateConnectorComponent(base.DBConnectorComponent):
     # Documentation is in developer/db.rst
 
+    STATE_CACHE_SIZE = 8192
+    STATE_CACHE_MAX_VALUE_LENGTH = 1024
+
+    def __init__(self, connector):
+        base.DBConnectorComponent.__init__(self, connector)
+        # values known to be in the database, so that setting the same value
+        # again does not need to touch it, and values known to be missing, so
+        # that looking them up with a default does not either.  Only a single
+        # master can know either, as other masters may write at any time;
+        # changes made to object_state by other means are only seen once a
+        # value is read again.
+        self._stateCache = _StateCache(self.STATE_CACHE_SIZE,
+                                       self.STATE_CACHE_MAX_VALUE_LENGTH)
+        self._queries = {}
+        self._compiledCache = {}
+
+    def _getQuery(self, build):
+        # the model is not necessarily set up when the component is created,
+        # so build queries on first use
+        q = self._queries.get(build)
+        if q is None:
+            q = self._queries[build] = build(self.db.model)
+        return q
+
+    def _thdExecute(self, conn, q, **params):
+        conn = conn.execution_options(compiled_cache=self._compiledCache)
+        return conn.execute(q, **params)
+
     def getObjectId(self, name, class_name):
+        # there are few class names, so intern them to make comparing cache
+        # keys cheap (Python 2 can only intern byte strings)
+        if isinstance(class_name, str):
+            class_name = intern(class_name)
         # defer to a cached method that only takes one parameter (a tuple)
         d = self._getObjectId((name, class_name))
-        d.addCallback(lambda objdict: objdict['id'])
+        d.addCallback(lambda objectid: objectid.id)
         return d
 
     @base.cached('objectids')
     def _getObjectId(self, name_class_name_tuple):
         name, class_name = name_class_name_tuple
-
-        def thd(conn):
-            return self.thdGetObjectId(conn, name, class_name)
-        return self.db.pool.do(thd)
+        d = self.db.pool.do(self.thdGetObjectId, name, class_name)
+        d.addCallback(_ObjectId)
+        return d
 
     def thdGetObjectId(self, conn, name, class_name):
         objects_tbl = self.db.model.objects
@@ -55,113 +212,244 @@ class StateConnectorComponent(base.DBConnectorComponent):
         self.checkLength(objects_tbl.c.name, name)
         self.checkLength(objects_tbl.c.class_name, class_name)
 
-        def select():
-            q = sa.select([objects_tbl.c.id],
-                          whereclause=((objects_tbl.c.name == name)
-                                       & (objects_tbl.c.class_name == class_name)))
+        upsert = self._getUpsertDialect(conn)
+        if upsert:
+            # a single statement leaves no window for a race, but give tests
+            # the chance to insert a conflicting row first
+            self._test_timing_hook(conn)
+
+        if upsert == 'postgresql':
+            # the no-op update makes RETURNING produce the id of an existing
+            # row as well as that of a new one
+            q = pg_insert(objects_tbl).values(name=name,
+                                              class_name=class_name)
+            q = q.on_conflict_do_update(
+                index_elements=[objects_tbl.c.name, objects_tbl.c.class_name],
+                set_=dict(name=q.excluded.name))
+            res = conn.execute(q.returning(objects_tbl.c.id))
+            return res.scalar()
+        elif upsert == 'mysql':
+            # LAST_INSERT_ID(id) makes the id of an existing row available as
+            # lastrowid
+            q = mysql_insert(objects_tbl).values(name=name,
+                                                 class_name=class_name)
+            q = q.on_duplicate_key_update(
+                id=sa.func.last_insert_id(objects_tbl.c.id))
             res = conn.execute(q)
-            row = res.fetchone()
-            res.close()
-            if not row:
-                raise _IdNotFoundError
-            return row.id
-
-        def insert():
-            res = conn.execute(objects_tbl.insert(),
-                               name=name,
-                               class_name=class_name)
-            return res.inserted_primary_key[0]
+            return res.lastrowid
 
-        # we want to try selecting, then inserting, but if the insert fails
-        # then try selecting again.  We include an invocation of a hook
-        # method to allow tests to exercise this particular behavior
-        try:
-            return ObjDict(id=select())
-        except _IdNotFoundError:
-            pass
+        # other databases have no single-statement upsert, so we try selecting,
+        # then inserting, but if the insert fails then try selecting again.  We
+        # include an invocation of a hook method to allow tests to exercise
+        # this particular behavior
+        id = self._thdSelectObjectId(conn, name, class_name)
+        if id is not None:
+            return id
 
         self._test_timing_hook(conn)
 
         try:
-            return ObjDict(id=insert())
+            return self._thdInsertObject(conn, name, class_name)
         except (sqlalchemy.exc.IntegrityError,
                 sqlalchemy.exc.ProgrammingError):
             pass
 
-        return ObjDict(id=select())
+        return self._thdSelectObjectId(conn, name, class_name)
+
+    def _thdSelectObjectId(self, conn, name, class_name):
+        q = self._getQuery(_selectObjectIdQuery)
+        return self._thdExecute(conn, q, q_name=name,
+                                q_class_name=class_name).scalar()
+
+    def _thdInsertObject(self, conn, name, class_name):
+        res = self._thdExecute(conn, self._getQuery(_insertObjectQuery),
+                               name=name,
+                               class_name=class_name)
+        return res.inserted_primary_key[0]
+
+    def _getUpsertDialect(self, conn):
+        # return the name of the dialect if the database supports an "insert
+        # or update" statement that SQLAlchemy can express, or None
+        dialect = conn.dialect
+        if dialect.name == 'postgresql':
+            # ON CONFLICT is available from PostgreSQL 9.5
+            version = dialect.server_version_info or ()
+            if pg_insert is not None and version >= (9, 5):
+                return 'postgresql'
+        elif dialect.name == 'mysql':
+            if mysql_insert is not None:
+                return 'mysql'
+        return None
 
     class Thunk:
         pass
 
     def getState(self, objectid, name, default=Thunk):
-        def thd(conn):
-            return self.thdGetState(conn, objectid, name, default=default)
-        return self.db.pool.do(thd)
+        return self.db.pool.do(self.thdGetState, objectid, name,
+                               default=default)
 
     def thdGetState(self, conn, objectid, name, default=Thunk):
-        object_state_tbl = self.db.model.object_state
-
-        q = sa.select([object_state_tbl.c.value_json],
-                      whereclause=((object_state_tbl.c.objectid == objectid)
-                                   & (object_state_tbl.c.name == name)))
-        res = conn.execute(q)
-        row = res.fetchone()
-        res.close()
+        key = (objectid, name)
+        cachesState = self._thdCachesState()
+        # a value known to be missing is only trusted when there is a default;
+        # otherwise the database gets the final word before raising KeyError
+        if (cachesState and default is not self.Thunk and
+                self._stateCache.get(key) is _MISSING_STATE):
+            return default
 
-        if not row:
+        generation = self._stateCache.generation
+        q = self._getQuery(_selectStateQuery)
+        # value_json is not nullable, so None means there is no such row; the
+        # column value goes straight to the JSON parser without building a row
+        value_json = self._thdExecute(conn, q, q_objectid=objectid,
+                                      q_name=name).scalar()
+
+        if cachesState:
+            self._stateCache.fill(
+                key, _MISSING_STATE if value_json is None else value_json,
+                generation)
+        if value_json is None:
             if default is self.Thunk:
                 raise KeyError("no such state value '%s' for object %d" %
                                (name, objectid))
             return default
         try:
-            return json.loads(row.value_json)
+            return _loads(value_json)
         except ValueError:
             raise TypeError("JSON error loading state value '%s' for %d" %
                             (name, objectid))
 
+    def _thdCachesState(self):
+        # other masters may write state values at any time, so only a single
+        # master can remember them; forget everything if that changes
+        config = getattr(self.master, 'config', None)
+        if config is not None and not config.multiMaster:
+            return True
+        self._stateCache.clear()
+        return False
+
     def setState(self, objectid, name, value):
-        def thd(conn):
-            return self.thdSetState(conn, objectid, name, value)
-        return self.db.pool.do(thd)
+        return self.db.pool.do(self.thdSetState, objectid, name, value)
 
     def thdSetState(self, conn, objectid, name, value):
+        self.thdSetStates(conn, objectid, [(name, value)])
+
+    def setStates(self, objectid, items):
+        return self.db.pool.do(self.thdSetStates, objectid, items)
+
+    def thdSetStates(self, conn, objectid, items):
         object_state_tbl = self.db.model.object_state
 
-        try:
-            value_json = json.dumps(value)
-        except (TypeError, ValueError):
-            raise TypeError("Error encoding JSON for %r" % (value,))
+        # encode everything before writing anything; later values for the
+        # same name replace earlier ones, as they would with setState
+        values_json = collections.OrderedDict()
+        for name, value in items:
+            try:
+                value_json = _dumps(value)
+            except (TypeError, ValueError):
+                raise TypeError("Error encoding JSON for %r" % (value,))
 
-        self.checkLength(object_state_tbl.c.name, name)
+            self.checkLength(object_state_tbl.c.name, name)
 
-        def update():
-            q = object_state_tbl.update(
-                whereclause=((object_state_tbl.c.objectid == objectid)
-                             & (object_state_tbl.c.name == name)))
-            res = conn.execute(q, value_json=value_json)
+            values_json.pop(name, None)
+            values_json[name] = value_json
 
-            # check whether that worked
-            return res.rowcount > 0
+        cachesState = self._thdCachesState()
+        if cachesState:
+            # the cache is only checked and updated around the write, never
+            # locked across it; see _StateCache.update
+            generation = self._stateCache.generation
+            for name, value_json in list(values_json.items()):
+                if self._stateCache.get((objectid, name)) == value_json:
+                    del values_json[name]
 
-        def insert():
-            conn.execute(object_state_tbl.insert(),
-                         objectid=objectid,
-                         name=name,
-                         value_json=value_json)
+            if not values_json:
+                return
 
-        # try updating; if that fails, try inserting; if that fails, then
-        # we raced with another instance to insert, so let that instance
-        # win.
+        try:
+            self._thdWriteStates(conn, objectid, list(values_json.items()))
+        except Exception:
+            for name in values_json:
+                self._stateCache.discard((objectid, name))
+            raise
+        if cachesState:
+            self._stateCache.update(
+                [((objectid, name), value_json)
+                 for name, value_json in values_json.items()], generation)
+
+    def _thdWriteStates(self, conn, objectid, values_json):
+        object_state_tbl = self.db.model.object_state
 
-        if update():
+        upsert = self._getUpsertDialect(conn)
+        if upsert:
+            # a single statement leaves no window for a race, but give tests
+            # the chance to insert a conflicting row first
+            self._test_timing_hook(conn)
+
+        if upsert == 'postgresql':
+            for batch in self.doBatch(values_json):
+                q = pg_insert(object_state_tbl).values(
+                    [dict(objectid=objectid, name=name, value_json=value_json)
+                     for name, value_json in batch])
+                q = q.on_conflict_do_update(
+                    index_elements=[object_state_tbl.c.objectid,
+                                    object_state_tbl.c.name],
+                    set_=dict(value_json=q.excluded.value_json))
+                conn.execute(q)
+            return
+        elif upsert == 'mysql':
+            for batch in self.doBatch(values_json):
+                q = mysql_insert(object_state_tbl).values(
+                    [dict(objectid=objectid, name=name, value_json=value_json)
+                     for name, value_json in batch])
+                q = q.on_duplicate_key_update(
+                    value_json=q.inserted.value_json)
+                conn.execute(q)
             return
 
-        self._test_timing_hook(conn)
-
+        # otherwise, try updating each row and insert it if that fails, all in
+        # one transaction so that there is a single commit.  If an insert
+        # fails, we raced with another instance to insert, so start over with
+        # a commit per statement, and overwrite its value as an upsert would.
+        transaction = conn.begin()
         try:
-            insert()
-        except (sqlalchemy.exc.IntegrityError, sqlalchemy.exc.ProgrammingError):
-            pass  # someone beat us to it - oh well
+            for name, value_json in values_json:
+                if not self._thdUpdateState(conn, objectid, name, value_json):
+                    self._test_timing_hook(conn)
+                    self._thdInsertState(conn, objectid, name, value_json)
+        except (sqlalchemy.exc.IntegrityError,
+                sqlalchemy.exc.ProgrammingError):
+            transaction.rollback()
+        except Exception:
+            transaction.rollback()
+            raise
+        else:
+            transaction.commit()
+            return
+
+        for name, value_json in values_json:
+            if self._thdUpdateState(conn, objectid, name, value_json):
+                continue
+            self._test_timing_hook(conn)
+            try:
+                self._thdInsertState(conn, objectid, name, value_json)
+            except (sqlalchemy.exc.IntegrityError,
+                    sqlalchemy.exc.ProgrammingError):
+                self._thdUpdateState(conn, objectid, name, value_json)
+
+    def _thdUpdateState(self, conn, objectid, name, value_json):
+        q = self._getQuery(_updateStateQuery)
+        res = self._thdExecute(conn, q, q_objectid=objectid, q_name=name,
+                               value_json=value_json)
+
+        # check whether that worked
+        return res.rowcount > 0
+
+    def _thdInsertState(self, conn, objectid, name, value_json):
+        self._thdExecute(conn, self._getQuery(_insertStateQuery),
+                         objectid=objectid,
+                         name=name,
+                         value_json=value_json)
 
     def _test_timing_hook(self, conn):
         # called so tests can simulate another process inserting a database row
@@ -170,22 +458,40 @@ class StateConnectorComponent(base.DBConnectorComponent):
 
     def atomicCreateState(self, objectid, name, thd_create_callback):
         def thd(conn):
-            object_state_tbl = self.db.model.object_state
             res = self.thdGetState(conn, objectid, name, default=None)
             if res is None:
                 res = thd_create_callback()
                 try:
-                    value_json = json.dumps(res)
+                    value_json = _dumps(res)
                 except (TypeError, ValueError):
                     raise TypeError("Error encoding JSON for %r" % (res,))
                 self._test_timing_hook(conn)
-                try:
-                    conn.execute(object_state_tbl.insert(),
-                                 objectid=objectid,
-                                 name=name,
-                                 value_json=value_json)
-                except (sqlalchemy.exc.IntegrityError, sqlalchemy.exc.ProgrammingError):
+                if not self._thdCreateState(conn, objectid, name, value_json):
                     # someone beat us to it - oh well return that value
                     return self.thdGetState(conn, objectid, name)
+                # a concurrent setState may already have replaced the value,
+                # so leave it to the next read to cache it
+                self._stateCache.discard((objectid, name))
             return res
         return self.db.pool.do(thd)
+
+    def _thdCreateState(self, conn, objectid, name, value_json):
+        # insert the row unless there already is one, and return whether it
+        # was inserted
+        if self._getUpsertDialect(conn) == 'postgresql':
+            # ON CONFLICT DO NOTHING reports an existing row without raising
+            # an error
+            object_state_tbl = self.db.model.object_state
+            q = pg_insert(object_state_tbl).values(objectid=objectid,
+                                                   name=name,
+                                                   value_json=value_json)
+            q = q.on_conflict_do_nothing(
+                index_elements=[object_state_tbl.c.objectid,
+                                object_state_tbl.c.name])
+            return conn.execute(q).rowcount > 0
+
+        try:
+            self._thdInsertState(conn, objectid, name, value_json)
+        except (sqlalchemy.exc.IntegrityError, sqlalchemy.exc.ProgrammingError):
+            return False
+        return True
@@ -19,6 +19,8 @@ from __future__ import print_function
 import sqlalchemy as sa
 from sqlalchemy.sql.expression import and_
 
+from twisted.internet import defer
+
 from buildbot.db import base
 from buildbot.util import identifiers
 
@@ -31,64 +33,165 @@ class UsersConnectorComponent(base.DBConnectorComponent):
     # Documentation is in developer/db.rst
 
     def findUserByAttr(self, identifier, attr_type, attr_data, _race_hook=None):
+        def thd(conn):
+            return self._thdFindUserByAttr(conn, identifier, attr_type,
+                                           attr_data, _race_hook)
+        d = self.db.pool.do(thd)
+        return d
+
+    def _thdFindUserByAttr(self, conn, identifier, attr_type, attr_data,
+                           _race_hook, no_recurse=False):
         # note that since this involves two tables, self.findSomethingId is not
         # helpful
-        def thd(conn, no_recurse=False, identifier=identifier):
-            tbl = self.db.model.users
-            tbl_info = self.db.model.users_info
+        tbl = self.db.model.users
+        tbl_info = self.db.model.users_info
+
+        self.checkLength(tbl.c.identifier, identifier)
+        self.checkLength(tbl_info.c.attr_type, attr_type)
+        self.checkLength(tbl_info.c.attr_data, attr_data)
+
+        # try to find the user
+        q = sa.select([tbl_info.c.uid],
+                      whereclause=and_(tbl_info.c.attr_type == attr_type,
+                                       tbl_info.c.attr_data == attr_data))
+        rows = conn.execute(q).fetchall()
+
+        if rows:
+            return rows[0].uid
+
+        _race_hook and _race_hook(conn)
+
+        # try to do both of these inserts in a transaction, so that both
+        # the new user and the corresponding attributes appear at the same
+        # time from the perspective of other masters.
+        transaction = conn.begin()
+        inserted_user = False
+        try:
+            r = conn.execute(tbl.insert(), dict(identifier=identifier))
+            uid = r.inserted_primary_key[0]
+            inserted_user = True
+
+            conn.execute(tbl_info.insert(),
+                         dict(uid=uid, attr_type=attr_type,
+                              attr_data=attr_data))
 
-            self.checkLength(tbl.c.identifier, identifier)
-            self.checkLength(tbl_info.c.attr_type, attr_type)
-            self.checkLength(tbl_info.c.attr_data, attr_data)
+            transaction.commit()
+        except (sa.exc.IntegrityError, sa.exc.ProgrammingError):
+            transaction.rollback()
+
+            # try it all over again, in case there was an overlapping,
+            # identical call to findUserByAttr.  If the identifier
+            # collided, we'll try again indefinitely; otherwise, only once.
+            if no_recurse:
+                raise
+
+            # if we failed to insert the user, then it's because the
+            # identifier wasn't unique
+            if not inserted_user:
+                identifier = identifiers.incrementIdentifier(
+                    256, identifier)
+            else:
+                no_recurse = True
+
+            return self._thdFindUserByAttr(conn, identifier, attr_type,
+                                           attr_data, _race_hook,
+                                           no_recurse=no_recurse)
+
+        return uid
+
+    def addUserWithAttrs(self, identifier, bb_username, bb_password, attrs):
+        if not attrs:
+            return defer.fail(ValueError("addUserWithAttrs requires at least "
+                                         "one attribute"))
 
-            # try to find the user
-            q = sa.select([tbl_info.c.uid],
-                          whereclause=and_(tbl_info.c.attr_type == attr_type,
-                                           tbl_info.c.attr_data == attr_data))
-            rows = conn.execute(q).fetchall()
+        def thd(conn):
+            return self._thdAddUserWithAttrs(conn, identifier, bb_username,
+                                             bb_password, list(attrs.items()))
+        d = self.db.pool.do(thd)
+        return d
 
-            if rows:
-                return rows[0].uid
+    def _thdAddUserWithAttrs(self, conn, identifier, bb_username,
+                             bb_password, attr_items, no_recurse=False):
+        tbl = self.db.model.users
+        tbl_info = self.db.model.users_info
 
-            _race_hook and _race_hook(conn)
+        self.checkLength(tbl.c.identifier, identifier)
+        for attr_type, attr_data in attr_items:
+            self.checkLength(tbl_info.c.attr_type, attr_type)
+            self.checkLength(tbl_info.c.attr_data, attr_data)
 
-            # try to do both of these inserts in a transaction, so that both
-            # the new user and the corresponding attributes appear at the same
-            # time from the perspective of other masters.
-            transaction = conn.begin()
-            inserted_user = False
-            try:
+        # as with findUserByAttr followed by updateUser for each further
+        # attribute, the identifier and credentials are only set along with
+        # further attributes
+        update_dict = {}
+        if len(attr_items) > 1:
+            update_dict['identifier'] = identifier
+            if bb_username is not None:
+                assert bb_password is not None
+                self.checkLength(tbl.c.bb_username, bb_username)
+                self.checkLength(tbl.c.bb_password, bb_password)
+                update_dict['bb_username'] = bb_username
+                update_dict['bb_password'] = bb_password
+
+        # find the user by its first attribute
+        attr_type, attr_data = attr_items[0]
+        q = sa.select([tbl_info.c.uid],
+                      whereclause=and_(tbl_info.c.attr_type == attr_type,
+                                       tbl_info.c.attr_data == attr_data))
+        row = conn.execute(q).fetchone()
+        uid = row.uid if row else None
+
+        # create or update the user and all of its attributes in one
+        # transaction, so that other masters never see a partial user
+        transaction = conn.begin()
+        try:
+            if uid is None:
                 r = conn.execute(tbl.insert(), dict(identifier=identifier))
                 uid = r.inserted_primary_key[0]
-                inserted_user = True
+                new_attr_items = attr_items
+            else:
+                q = sa.select([tbl_info.c.attr_type],
+                              whereclause=(tbl_info.c.uid == uid))
+                existing = set(r.attr_type for r in conn.execute(q))
+                new_attr_items = []
+                for attr_type, attr_data in attr_items[1:]:
+                    if attr_type in existing:
+                        q = tbl_info.update(
+                            whereclause=(tbl_info.c.uid == uid)
+                            & (tbl_info.c.attr_type == attr_type))
+                        conn.execute(q, attr_data=attr_data)
+                    else:
+                        new_attr_items.append((attr_type, attr_data))
 
+            if update_dict:
+                q = tbl.update(whereclause=(tbl.c.uid == uid))
+                conn.execute(q, update_dict)
+
+            if new_attr_items:
                 conn.execute(tbl_info.insert(),
-                             dict(uid=uid, attr_type=attr_type,
-                                  attr_data=attr_data))
-
-                transaction.commit()
-            except (sa.exc.IntegrityError, sa.exc.ProgrammingError):
-                transaction.rollback()
-
-                # try it all over again, in case there was an overlapping,
-                # identical call to findUserByAttr.  If the identifier
-                # collided, we'll try again indefinitely; otherwise, only once.
-                if no_recurse:
-                    raise
-
-                # if we failed to insert the user, then it's because the
-                # identifier wasn't unique
-                if not inserted_user:
-                    identifier = identifiers.incrementIdentifier(
-                        256, identifier)
-                else:
-                    no_recurse = True
-
-                return thd(conn, no_recurse=no_recurse, identifier=identifier)
-
-            return uid
-        d = self.db.pool.do(thd)
-        return d
+                             [dict(uid=uid, attr_type=attr_type,
+                                   attr_data=attr_data)
+                              for attr_type, attr_data in new_attr_items])
+
+            transaction.commit()
+        except (sa.exc.IntegrityError, sa.exc.ProgrammingError):
+            transaction.rollback()
+
+            # try it all over again, as findUserByAttr does: indefinitely if
+            # the identifier of a new user collided, otherwise only once
+            if no_recurse:
+                raise
+            if uid is None:
+                identifier = identifiers.incrementIdentifier(
+                    256, identifier)
+            else:
+                no_recurse = True
+
+            return self._thdAddUserWithAttrs(conn, identifier, bb_username,
+                                             bb_password, attr_items,
+                                             no_recurse=no_recurse)
+
+        return uid
 
     @base.cached("usdicts")
     def getUser(self, uid):
@@ -162,62 +265,67 @@ class UsersConnectorComponent(base.DBConnectorComponent):
                    bb_password=None, attr_type=None, attr_data=None,
                    _race_hook=None):
         def thd(conn):
-            transaction = conn.begin()
-            tbl = self.db.model.users
-            tbl_info = self.db.model.users_info
-            update_dict = {}
+            self._thdUpdateUser(conn, uid, identifier, bb_username,
+                                bb_password, attr_type, attr_data, _race_hook)
+        d = self.db.pool.do(thd)
+        return d
 
-            # first, add the identifier is it exists
-            if identifier is not None:
-                self.checkLength(tbl.c.identifier, identifier)
-                update_dict['identifier'] = identifier
+    def _thdUpdateUser(self, conn, uid, identifier, bb_username, bb_password,
+                       attr_type, attr_data, _race_hook):
+        transaction = conn.begin()
+        tbl = self.db.model.users
+        tbl_info = self.db.model.users_info
+        update_dict = {}
 
-            # then, add the creds if they exist
-            if bb_username is not None:
-                assert bb_password is not None
-                self.checkLength(tbl.c.bb_username, bb_username)
-                self.checkLength(tbl.c.bb_password, bb_password)
-                update_dict['bb_username'] = bb_username
-                update_dict['bb_password'] = bb_password
+        # first, add the identifier is it exists
+        if identifier is not None:
+            self.checkLength(tbl.c.identifier, identifier)
+            update_dict['identifier'] = identifier
+
+        # then, add the creds if they exist
+        if bb_username is not None:
+            assert bb_password is not None
+            self.checkLength(tbl.c.bb_username, bb_username)
+            self.checkLength(tbl.c.bb_password, bb_password)
+            update_dict['bb_username'] = bb_username
+            update_dict['bb_password'] = bb_password
+
+        # update the users table if it needs to be updated
+        if update_dict:
+            q = tbl.update(whereclause=(tbl.c.uid == uid))
+            res = conn.execute(q, update_dict)
+
+        # then, update the attributes, carefully handling the potential
+        # update-or-insert race condition.
+        if attr_type is not None:
+            assert attr_data is not None
 
-            # update the users table if it needs to be updated
-            if update_dict:
-                q = tbl.update(whereclause=(tbl.c.uid == uid))
-                res = conn.execute(q, update_dict)
-
-            # then, update the attributes, carefully handling the potential
-            # update-or-insert race condition.
-            if attr_type is not None:
-                assert attr_data is not None
-
-                self.checkLength(tbl_info.c.attr_type, attr_type)
-                self.checkLength(tbl_info.c.attr_data, attr_data)
-
-                # first update, then insert
-                q = tbl_info.update(
-                    whereclause=(tbl_info.c.uid == uid)
-                    & (tbl_info.c.attr_type == attr_type))
-                res = conn.execute(q, attr_data=attr_data)
-                if res.rowcount == 0:
-                    if _race_hook is not None:
-                        _race_hook(conn)
-
-                    # the update hit 0 rows, so try inserting a new one
-                    try:
-                        q = tbl_info.insert()
-                        res = conn.execute(q,
-                                           uid=uid,
-                                           attr_type=attr_type,
-                                           attr_data=attr_data)
-                    except (sa.exc.IntegrityError, sa.exc.ProgrammingError):
-                        # someone else beat us to the punch inserting this row;
-                        # let them win.
-                        transaction.rollback()
-                        return
+            self.checkLength(tbl_info.c.attr_type, attr_type)
+            self.checkLength(tbl_info.c.attr_data, attr_data)
 
-            transaction.commit()
-        d = self.db.pool.do(thd)
-        return d
+            # first update, then insert
+            q = tbl_info.update(
+                whereclause=(tbl_info.c.uid == uid)
+                & (tbl_info.c.attr_type == attr_type))
+            res = conn.execute(q, attr_data=attr_data)
+            if res.rowcount == 0:
+                if _race_hook is not None:
+                    _race_hook(conn)
+
+                # the update hit 0 rows, so try inserting a new one
+                try:
+                    q = tbl_info.insert()
+                    res = conn.execute(q,
+                                       uid=uid,
+                                       attr_type=attr_type,
+                                       attr_data=attr_data)
+                except (sa.exc.IntegrityError, sa.exc.ProgrammingError):
+                    # someone else beat us to the punch inserting this row;
+                    # let them win.
+                    transaction.rollback()
+                    return
+
+        transaction.commit()
 
     def removeUser(self, uid):
         def thd(conn):
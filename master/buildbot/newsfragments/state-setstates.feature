@@ -0,0 +1 @@
+The state database component has a new :py:meth:`~buildbot.db.state.StateConnectorComponent.setStates` method to set several state values of an object at once.
@@ -17,15 +17,36 @@ from __future__ import absolute_import
 from __future__ import print_function
 from future.utils import string_types
 
+import collections
+import functools
+
 from twisted.internet import defer
 from twisted.python import log
 
 from buildbot import pbutil
 from buildbot.util import service
 
+
+def _gatherResults(deferreds):
+    # like defer.gatherResults, but fail with the first failure itself rather
+    # than a FirstError, so that `buildbot user` sees the original exception
+    d = defer.gatherResults(deferreds, consumeErrors=True)
+
+    @d.addErrback
+    def unwrap(f):
+        f.trap(defer.FirstError)
+        return f.value.subFailure
+    return d
+
+
 # this class is known to contain cruft and will be looked at later, so
 # no current implementation utilizes it aside from scripts.runner.
 
+# line formats used by formatResults
+_IDENTIFIER_LINE = "identifier: %s\n"
+_UID_LINE = "uid: %d\n\n"
+_ATTR_LINE = "%s: %s\n"
+
 
 class CommandlineUserManagerPerspective(pbutil.NewCredPerspective):
 
@@ -51,40 +72,40 @@ class CommandlineUserManagerPerspective(pbutil.NewCredPerspective):
 
         @returns: string containing formatted results
         """
-        formatted_results = ""
+        formatted_results = []
 
         if op == 'add':
             # list, alternating ident, uid
-            formatted_results += "user(s) added:\n"
+            formatted_results.append("user(s) added:\n")
             for user in results:
                 if isinstance(user, string_types):
-                    formatted_results += "identifier: %s\n" % user
+                    formatted_results.append(_IDENTIFIER_LINE % user)
                 else:
-                    formatted_results += "uid: %d\n\n" % user
+                    formatted_results.append(_UID_LINE % user)
         elif op == 'remove':
             # list of dictionaries
-            formatted_results += "user(s) removed:\n"
+            formatted_results.append("user(s) removed:\n")
             for user in results:
                 if user:
-                    formatted_results += "identifier: %s\n" % (user)
+                    formatted_results.append(_IDENTIFIER_LINE % user)
         elif op == 'update':
             # list, alternating ident, None
-            formatted_results += "user(s) updated:\n"
+            formatted_results.append("user(s) updated:\n")
             for user in results:
                 if user:
-                    formatted_results += "identifier: %s\n" % (user)
+                    formatted_results.append(_IDENTIFIER_LINE % user)
         elif op == 'get':
             # list of dictionaries
-            formatted_results += "user(s) found:\n"
+            formatted_results.append("user(s) found:\n")
             for user in results:
                 if user:
-                    for key in sorted(user.keys()):
-                        if key != 'bb_password':
-                            formatted_results += "%s: %s\n" % (key, user[key])
-                    formatted_results += "\n"
+                    formatted_results.extend(
+                        _ATTR_LINE % (key, user[key])
+                        for key in sorted(user) if key != 'bb_password')
+                    formatted_results.append("\n")
                 else:
-                    formatted_results += "no match found\n"
-        return formatted_results
+                    formatted_results.append("no match found\n")
+        return "".join(formatted_results)
 
     @defer.inlineCallbacks
     def perspective_commandline(self, op, bb_username, bb_password, ids, info):
@@ -114,80 +135,136 @@ class CommandlineUserManagerPerspective(pbutil.NewCredPerspective):
         """
         log.msg("perspective_commandline called")
         results = []
+        # identifier -> uid, so that each identifier is looked up at most once
+        uid_cache = {}
 
-        # pylint: disable=too-many-nested-blocks
         if ids:
-            for user in ids:
-                # get identifier, guaranteed to be in user from checks
-                # done in C{scripts.runner}
-                uid = yield self.master.db.users.identifierToUid(
-                    identifier=user)
+            # get identifiers, guaranteed to be in user from checks done in
+            # C{scripts.runner}, and look them up all at once
+            yield self._lookupUids(ids, uid_cache)
 
-                result = None
+            dl = []
+            removed = set()
+            for user in ids:
+                uid = uid_cache[user]
+                d = defer.succeed(None)
                 if op == 'remove':
-                    if uid:
-                        yield self.master.db.users.removeUser(uid)
-                        result = user
+                    # a user named more than once is only removed once, as
+                    # the later identifiers would not be found any more
+                    if uid and uid not in removed:
+                        removed.add(uid)
+                        d = self.master.db.users.removeUser(uid)
+                        d.addCallback(lambda _, user=user: user)
                     else:
                         log.msg("Unable to find uid for identifier %s" % user)
                 elif op == 'get':
                     if uid:
-                        result = yield self.master.db.users.getUser(uid)
+                        d = self.master.db.users.getUser(uid)
                     else:
                         log.msg("Unable to find uid for identifier %s" % user)
+                dl.append(d)
+            results = yield _gatherResults(dl)
+        else:
+            # resolve the identifiers of users that are not added with
+            # attributes up front, then handle each user concurrently,
+            # keeping the results in order.  Entries for the same user are
+            # handled one after the other, in command-line order.
+            yield self._lookupUids(
+                [user['identifier'] for user in info
+                 if op != 'add' or len(user) == 1], uid_cache)
+            user_results = yield self._gatherPerKey(
+                [(uid_cache.get(user['identifier']) or user['identifier'],
+                  functools.partial(self._commandlineUserInfo, op,
+                                    bb_username, bb_password, user,
+                                    uid_cache))
+                 for user in info])
+            for user_result in user_results:
+                results.extend(user_result)
+        results = self.formatResults(op, results)
+        defer.returnValue(results)
 
-                results.append(result)
+    @defer.inlineCallbacks
+    def _lookupUids(self, identifiers, uid_cache):
+        # look up the identifiers that are not in uid_cache yet, once each
+        # and concurrently, and store their uids there
+        missing = [ident for ident in set(identifiers)
+                   if ident not in uid_cache]
+        uids = yield _gatherResults(
+            [self.master.db.users.identifierToUid(identifier=ident)
+             for ident in missing])
+        uid_cache.update(zip(missing, uids))
+
+    @defer.inlineCallbacks
+    def _gatherPerKey(self, calls):
+        # call each function in calls, a list of (key, function) pairs, and
+        # return their results in order; functions with the same key are
+        # called one after the other, and the others concurrently
+        groups = collections.OrderedDict()
+        for i, (key, fn) in enumerate(calls):
+            groups.setdefault(key, []).append((i, fn))
+
+        @defer.inlineCallbacks
+        def callGroup(group):
+            group_results = []
+            for i, fn in group:
+                res = yield fn()
+                group_results.append((i, res))
+            defer.returnValue(group_results)
+
+        group_results = yield _gatherResults(
+            [callGroup(group) for group in groups.values()])
+        results = [None] * len(calls)
+        for group_result in group_results:
+            for i, res in group_result:
+                results[i] = res
+        defer.returnValue(results)
+
+    @defer.inlineCallbacks
+    def _commandlineUserInfo(self, op, bb_username, bb_password, user,
+                             uid_cache):
+        results = []
+
+        # get identifier, guaranteed to be in user from checks
+        # done in C{scripts.runner}
+        ident = user.pop('identifier')
+
+        if op == 'add' and user:
+            # the user is found or created using its first attribute, and
+            # the remaining ones are then added to it, all in one DB call
+            uid = yield self.master.db.users.addUserWithAttrs(
+                ident, bb_username, bb_password, user)
+            defer.returnValue([ident, uid])
+
+        # looked up by perspective_commandline before any user is handled
+        uid = uid_cache[ident]
+
+        # if only an identifier was in user, we're updating only
+        # the bb_username and bb_password.
+        if not user:
+            if uid:
+                yield self.master.db.users.updateUser(
+                    uid=uid,
+                    identifier=ident,
+                    bb_username=bb_username,
+                    bb_password=bb_password)
+                results.append(ident)
+            else:
+                log.msg("Unable to find uid for identifier %s"
+                        % user)
         else:
-            for user in info:
-                # get identifier, guaranteed to be in user from checks
-                # done in C{scripts.runner}
-                ident = user.pop('identifier')
-                uid = yield self.master.db.users.identifierToUid(
-                    identifier=ident)
-
-                # if only an identifier was in user, we're updating only
-                # the bb_username and bb_password.
-                if not user:
-                    if uid:
-                        result = yield self.master.db.users.updateUser(
-                            uid=uid,
-                            identifier=ident,
-                            bb_username=bb_username,
-                            bb_password=bb_password)
-                        results.append(ident)
-                    else:
-                        log.msg("Unable to find uid for identifier %s"
-                                % user)
+            for attr in user:
+                if uid:
+                    yield self.master.db.users.updateUser(
+                        uid=uid,
+                        identifier=ident,
+                        bb_username=bb_username,
+                        bb_password=bb_password,
+                        attr_type=attr,
+                        attr_data=user[attr])
                 else:
-                    # when adding, we update the user after the first attr
-                    once_through = False
-                    for attr in user:
-                        result = None
-                        if op == 'update' or once_through:
-                            if uid:
-                                result = yield self.master.db.users.updateUser(
-                                    uid=uid,
-                                    identifier=ident,
-                                    bb_username=bb_username,
-                                    bb_password=bb_password,
-                                    attr_type=attr,
-                                    attr_data=user[attr])
-                            else:
-                                log.msg("Unable to find uid for identifier %s"
-                                        % user)
-                        elif op == 'add':
-                            result = yield self.master.db.users.findUserByAttr(
-                                identifier=ident,
-                                attr_type=attr,
-                                attr_data=user[attr])
-                            once_through = True
-                        results.append(ident)
-
-                        # result is None from updateUser calls
-                        if result:
-                            results.append(result)
-                            uid = result
-        results = self.formatResults(op, results)
+                    log.msg("Unable to find uid for identifier %s"
+                            % user)
+                results.append(ident)
         defer.returnValue(results)
 
 
@@ -1648,6 +1648,11 @@ class FakeStateComponent(FakeDBComponent):
         self.states[objectid][name] = json.dumps(value)
         return defer.succeed(None)
 
+    def setStates(self, objectid, items):
+        for name, value in items:
+            self.states[objectid][name] = json.dumps(value)
+        return defer.succeed(None)
+
     def atomicCreateState(self, objectid, name, thd_create_callback):
         value = thd_create_callback()
         self.states[objectid][name] = json.dumps(bytes2NativeString(value))
@@ -2232,6 +2237,19 @@ class FakeUsersComponent(FakeDBComponent):
                                          attr_data=attr_data)])
         return defer.succeed(uid)
 
+    @defer.inlineCallbacks
+    def addUserWithAttrs(self, identifier, bb_username, bb_password, attrs):
+        if not attrs:
+            raise ValueError("addUserWithAttrs requires at least one "
+                             "attribute")
+        attr_items = list(attrs.items())
+        attr_type, attr_data = attr_items[0]
+        uid = yield self.findUserByAttr(identifier, attr_type, attr_data)
+        for attr_type, attr_data in attr_items[1:]:
+            yield self.updateUser(uid, identifier, bb_username, bb_password,
+                                  attr_type, attr_data)
+        defer.returnValue(uid)
+
     def getUser(self, uid):
         usdict = None
         if uid in self.users:
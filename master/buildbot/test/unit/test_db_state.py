@@ -16,9 +16,15 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import datetime
+import json
+
+import mock
+
 from twisted.internet import defer
 
 from buildbot.db import state
+from buildbot.process import cache
 from buildbot.test.fake import fakedb
 from buildbot.test.util import connector_component
 from buildbot.test.util import db
@@ -86,6 +92,23 @@ class TestStateConnectorComponent(
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_getObjectId_concurrent(self):
+        # the objectids cache collapses simultaneous misses, so concurrent
+        # callers share a single trip to the database
+        self.db.master.caches = cache.CacheManager()
+        self.db.state = state.StateConnectorComponent(self.db)
+        thdGetObjectId = mock.Mock(
+            side_effect=self.db.state.thdGetObjectId)
+        self.patch(self.db.state, 'thdGetObjectId', thdGetObjectId)
+
+        objectids = yield defer.gatherResults([
+            self.db.state.getObjectId('someobj', 'someclass'),
+            self.db.state.getObjectId('someobj', 'someclass')])
+
+        self.assertEqual(objectids[0], objectids[1])
+        self.assertEqual(thdGetObjectId.call_count, 1)
+
     def test_getState_missing(self):
         d = self.db.state.getState(10, 'nosuch')
         return self.assertFailure(d, KeyError)
@@ -106,6 +129,43 @@ class TestStateConnectorComponent(
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_getState_missing_cached(self):
+        yield self.insertTestData([
+            fakedb.Object(id=10, name='x', class_name='y'),
+        ])
+        res = yield self.db.state.getState(10, 'x', None)
+        self.assertEqual(res, None)
+
+        # a value missing with a default is not looked up again..
+        self.db.state._thdExecute = mock.Mock()
+        res = yield self.db.state.getState(10, 'x', 'abc')
+        self.assertEqual(res, 'abc')
+        self.assertFalse(self.db.state._thdExecute.called)
+        del self.db.state._thdExecute
+
+        # ..but it is without one, or once set
+        yield self.insertTestData([
+            fakedb.ObjectState(objectid=10, name='x', value_json='[1,2]'),
+        ])
+        res = yield self.db.state.getState(10, 'x')
+        self.assertEqual(res, [1, 2])
+        yield self.db.state.setState(10, 'y', 2)
+        res = yield self.db.state.getState(10, 'y', None)
+        self.assertEqual(res, 2)
+
+    @defer.inlineCallbacks
+    def test_getState_missing_not_cached_multiMaster(self):
+        self.db.master.config.multiMaster = True
+        res = yield self.db.state.getState(10, 'x', None)
+        self.assertEqual(res, None)
+        yield self.insertTestData([
+            fakedb.Object(id=10, name='x', class_name='y'),
+            fakedb.ObjectState(objectid=10, name='x', value_json='[1,2]'),
+        ])
+        res = yield self.db.state.getState(10, 'x', None)
+        self.assertEqual(res, [1, 2])
+
     def test_getState_present(self):
         d = self.insertTestData([
             fakedb.Object(id=10, name='x', class_name='y'),
@@ -140,12 +200,135 @@ class TestStateConnectorComponent(
                 q = self.db.model.object_state.select()
                 rows = conn.execute(q).fetchall()
                 self.assertEqual(
-                    [(r.objectid, r.name, r.value_json) for r in rows],
-                    [(10, 'x', '[1, 2]')])
+                    [(r.objectid, r.name, json.loads(r.value_json))
+                     for r in rows],
+                    [(10, 'x', [1, 2])])
             return self.db.pool.do(thd)
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_setState_unchanged(self):
+        yield self.insertTestData([
+            fakedb.Object(id=10, name='-', class_name='-'),
+        ])
+        yield self.db.state.setState(10, 'x', [1, 2])
+
+        # the value is known to be in the database, so it is not written again
+        conn = mock.Mock()
+        self.db.state.thdSetState(conn, 10, 'x', [1, 2])
+        self.assertEqual(conn.mock_calls, [])
+
+        yield self.db.state.setState(10, 'x', [3])
+        res = yield self.db.state.getState(10, 'x')
+        self.assertEqual(res, [3])
+
+    @defer.inlineCallbacks
+    def test_setState_unchanged_after_external_write(self):
+        yield self.insertTestData([
+            fakedb.Object(id=10, name='-', class_name='-'),
+        ])
+        yield self.db.state.setState(10, 'x', [1, 2])
+
+        def thd(conn):
+            q = self.db.model.object_state.update()
+            conn.execute(q, value_json='99')
+        yield self.db.pool.do(thd)
+
+        # reading the state picks up the value written by someone else
+        res = yield self.db.state.getState(10, 'x')
+        self.assertEqual(res, 99)
+        yield self.db.state.setState(10, 'x', [1, 2])
+        res = yield self.db.state.getState(10, 'x')
+        self.assertEqual(res, [1, 2])
+
+    @defer.inlineCallbacks
+    def test_setState_concurrent_not_cached(self):
+        yield self.insertTestData([
+            fakedb.Object(id=10, name='-', class_name='-'),
+        ])
+        thdWriteStates = self.db.state._thdWriteStates
+
+        def concurrentWrite(conn, objectid, values_json):
+            # another write finishes while this one is in progress
+            self.db.state._stateCache.discard((10, 'y'))
+            thdWriteStates(conn, objectid, values_json)
+        self.patch(self.db.state, '_thdWriteStates', concurrentWrite)
+        yield self.db.state.setState(10, 'x', [1, 2])
+
+        # which of the two writes landed last is unknown, so neither is cached
+        self.assertEqual(self.db.state._stateCache.values, {})
+
+    @defer.inlineCallbacks
+    def test_setState_unchanged_multiMaster(self):
+        self.db.master.config.multiMaster = True
+        yield self.insertTestData([
+            fakedb.Object(id=10, name='-', class_name='-'),
+        ])
+        yield self.db.state.setState(10, 'x', 1)
+
+        def thd(conn):
+            q = self.db.model.object_state.update()
+            conn.execute(q, value_json='2')
+        yield self.db.pool.do(thd)
+
+        # another master may have written in the meantime, so the value is
+        # written again even though it has not been read since
+        yield self.db.state.setState(10, 'x', 1)
+        res = yield self.db.state.getState(10, 'x')
+        self.assertEqual(res, 1)
+
+    @defer.inlineCallbacks
+    def test_setState_large_not_cached(self):
+        yield self.insertTestData([
+            fakedb.Object(id=10, name='-', class_name='-'),
+        ])
+        value = 'x' * self.db.state.STATE_CACHE_MAX_VALUE_LENGTH
+        yield self.db.state.setState(10, 'x', value)
+        self.assertEqual(self.db.state._stateCache.values, {})
+
+    @defer.inlineCallbacks
+    def test_setState_bigint(self):
+        yield self.insertTestData([
+            fakedb.Object(id=10, name='-', class_name='-'),
+        ])
+        yield self.db.state.setState(10, 'x', {'n': 2 ** 70 + 1})
+        res = yield self.db.state.getState(10, 'x')
+        self.assertEqual(res, {'n': 2 ** 70 + 1})
+
+    @defer.inlineCallbacks
+    def test_setState_nonascii(self):
+        yield self.insertTestData([
+            fakedb.Object(id=10, name='-', class_name='-'),
+        ])
+        yield self.db.state.setState(10, 'x', u'caf\xe9 \U0001f600')
+
+        def thd(conn):
+            q = self.db.model.object_state.select()
+            return conn.execute(q).fetchone().value_json
+        value_json = yield self.db.pool.do(thd)
+        self.assertEqual(value_json, u'"caf\\u00e9 \\ud83d\\ude00"')
+        res = yield self.db.state.getState(10, 'x')
+        self.assertEqual(res, u'caf\xe9 \U0001f600')
+
+    @defer.inlineCallbacks
+    def test_setState_nan(self):
+        yield self.insertTestData([
+            fakedb.Object(id=10, name='-', class_name='-'),
+        ])
+        yield self.db.state.setState(10, 'x', [float('inf')])
+        res = yield self.db.state.getState(10, 'x')
+        self.assertEqual(res, [float('inf')])
+
+    def test_setState_datetime(self):
+        d = self.insertTestData([
+            fakedb.Object(id=10, name='x', class_name='y'),
+        ])
+        d.addCallback(lambda _:
+                      self.db.state.setState(10, 'x',
+                                             datetime.datetime(2020, 1, 2)))
+        return self.assertFailure(d, TypeError)
+
     def test_setState_badjson(self):
         d = self.insertTestData([
             fakedb.Object(id=10, name='x', class_name='y'),
@@ -167,8 +350,9 @@ class TestStateConnectorComponent(
                 q = self.db.model.object_state.select()
                 rows = conn.execute(q).fetchall()
                 self.assertEqual(
-                    [(r.objectid, r.name, r.value_json) for r in rows],
-                    [(10, 'x', '[1, 2]')])
+                    [(r.objectid, r.name, json.loads(r.value_json))
+                     for r in rows],
+                    [(10, 'x', [1, 2])])
             return self.db.pool.do(thd)
         d.addCallback(check)
         return d
@@ -190,12 +374,63 @@ class TestStateConnectorComponent(
                 q = self.db.model.object_state.select()
                 rows = conn.execute(q).fetchall()
                 self.assertEqual(
-                    [(r.objectid, r.name, r.value_json) for r in rows],
-                    [(10, 'x', '22')])
+                    [(r.objectid, r.name, json.loads(r.value_json))
+                     for r in rows],
+                    [(10, 'x', [1, 2])])
             return self.db.pool.do(thd)
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_setStates(self):
+        yield self.insertTestData([
+            fakedb.Object(id=10, name='-', class_name='-'),
+            fakedb.ObjectState(objectid=10, name='x', value_json='99'),
+        ])
+        yield self.db.state.setStates(10, [('x', [1, 2]), ('y', 'a'),
+                                           ('z', 1), ('z', 2)])
+
+        def thd(conn):
+            q = self.db.model.object_state.select()
+            rows = conn.execute(q).fetchall()
+            self.assertEqual(
+                sorted([(r.objectid, r.name, json.loads(r.value_json))
+                        for r in rows]),
+                [(10, 'x', [1, 2]), (10, 'y', 'a'), (10, 'z', 2)])
+        yield self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def test_setStates_conflict(self):
+        yield self.insertTestData([
+            fakedb.Object(id=10, name='-', class_name='-'),
+            fakedb.ObjectState(objectid=10, name='y', value_json='99'),
+        ])
+
+        def hook(conn):
+            conn.execute(self.db.model.object_state.insert(),
+                         objectid=10, name='x', value_json='22')
+        self.db.state._test_timing_hook = hook
+        yield self.db.state.setStates(10, [('x', [1, 2]), ('y', 'a')])
+
+        def thd(conn):
+            q = self.db.model.object_state.select()
+            rows = conn.execute(q).fetchall()
+            self.assertEqual(
+                sorted([(r.objectid, r.name, json.loads(r.value_json))
+                        for r in rows]),
+                [(10, 'x', [1, 2]), (10, 'y', 'a')])
+        yield self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def test_setStates_badjson(self):
+        yield self.insertTestData([
+            fakedb.Object(id=10, name='-', class_name='-'),
+        ])
+        d = self.db.state.setStates(10, [('x', 1), ('y', self)])
+        yield self.assertFailure(d, TypeError)
+        res = yield self.db.state.getState(10, 'x', None)
+        self.assertEqual(res, None)
+
     @defer.inlineCallbacks
     def test_atomicCreateState(self):
         yield self.insertTestData([
@@ -206,6 +441,17 @@ class TestStateConnectorComponent(
         res = yield self.db.state.getState(10, 'x')
         self.assertEqual(res, [1, 2])
 
+    @defer.inlineCallbacks
+    def test_atomicCreateState_not_cached(self):
+        yield self.insertTestData([
+            fakedb.Object(id=10, name='-', class_name='-'),
+        ])
+        yield self.db.state.atomicCreateState(10, 'x', lambda: [1, 2])
+
+        # a concurrent setState may have replaced the created value, so it
+        # is written again rather than trusted
+        self.assertEqual(self.db.state._stateCache.values, {})
+
     @defer.inlineCallbacks
     def test_atomicCreateState_conflict(self):
         yield self.insertTestData([
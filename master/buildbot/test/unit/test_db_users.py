@@ -16,8 +16,11 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import collections
+
 import sqlalchemy
 
+from twisted.internet import defer
 from twisted.trial import unittest
 
 from buildbot.db import users
@@ -167,6 +170,62 @@ class TestUsersConnectorComponent(connector_component.ConnectorComponentMixin,
         d.addCallback(check_user)
         return d
 
+    @defer.inlineCallbacks
+    def test_addUserWithAttrs_new(self):
+        uid = yield self.db.users.addUserWithAttrs(
+            'soap', None, None,
+            collections.OrderedDict([('subspace_net_handle', 'Durden0924'),
+                                     ('IPv9', '0578cc6.8db024')]))
+        usdict = yield self.db.users.getUser(uid)
+        self.assertEqual(usdict, dict(uid=uid,
+                                      identifier='soap',
+                                      bb_username=None,
+                                      bb_password=None,
+                                      subspace_net_handle='Durden0924',
+                                      IPv9='0578cc6.8db024'))
+
+    @defer.inlineCallbacks
+    def test_addUserWithAttrs_existing(self):
+        yield self.insertTestData(self.user1_rows)
+        uid = yield self.db.users.addUserWithAttrs(
+            'soapy', None, None,
+            collections.OrderedDict([('IPv9', '0578cc6.8db024'),
+                                     ('git', 'soap <soap@x>')]))
+        self.assertEqual(uid, 1)
+        usdict = yield self.db.users.getUser(uid)
+        self.assertEqual(usdict, dict(uid=1,
+                                      identifier='soapy',
+                                      bb_username=None,
+                                      bb_password=None,
+                                      IPv9='0578cc6.8db024',
+                                      git='soap <soap@x>'))
+
+    @defer.inlineCallbacks
+    def test_addUserWithAttrs_rolled_back(self):
+        yield self.insertTestData(self.user1_rows + [
+            fakedb.User(uid=2, identifier='other', bb_username='bb',
+                        bb_password='pw'),
+        ])
+        # the credentials clash with those of another user, so nothing
+        # about the new user is kept
+        d = self.db.users.addUserWithAttrs(
+            'new', 'bb', 'pw',
+            collections.OrderedDict([('git', 'new <new@x>'),
+                                     ('irc', 'new')]))
+        yield self.assertFailure(d, sqlalchemy.exc.IntegrityError)
+        self.flushLoggedErrors(sqlalchemy.exc.IntegrityError)
+
+        def thd(conn):
+            users = conn.execute(self.db.model.users.select()).fetchall()
+            infos = conn.execute(self.db.model.users_info.select()).fetchall()
+            return sorted(r.uid for r in users), sorted(r.uid for r in infos)
+        uids, info_uids = yield self.db.pool.do(thd)
+        self.assertEqual((uids, info_uids), ([1, 2], [1]))
+
+    def test_addUserWithAttrs_no_attrs(self):
+        d = self.db.users.addUserWithAttrs('new', None, None, {})
+        return self.assertFailure(d, ValueError)
+
     def test_addUser_race(self):
         def race_thd(conn):
             # note that this assumes that both inserts can happen "at once".
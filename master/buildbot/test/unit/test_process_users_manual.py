@@ -283,6 +283,109 @@ class TestCommandlineUserManagerPerspective(unittest.TestCase, ManualUsersMixin)
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_perspective_commandline_get_multiple_users_format(self):
+        yield self.call_perspective_commandline(
+            'add', None, None, None,
+            [{'identifier': 'x@y', 'git': 'x <x@y>'},
+             {'identifier': 'a@b', 'git': 'a <a@b>'}])
+        result = yield self.call_perspective_commandline(
+            'get', None, None, ['a@b', 'nosuch', 'x@y'], None)
+
+        exp_format = ('user(s) found:\nbb_username: None\n'
+                      'git: a <a@b>\nidentifier: a@b\n'
+                      'uid: 2\n\n'
+                      'no match found\n'
+                      'bb_username: None\n'
+                      'git: x <x@y>\nidentifier: x@y\n'
+                      'uid: 1\n\n')
+        self.assertEqual(result, exp_format)
+
+    @defer.inlineCallbacks
+    def test_perspective_commandline_get_duplicate_ids(self):
+        yield self.call_perspective_commandline(
+            'add', None, None, None,
+            [{'identifier': 'x@y', 'git': 'x <x@y>'}])
+        identifierToUid = mock.Mock(
+            side_effect=self.master.db.users.identifierToUid)
+        self.patch(self.master.db.users, 'identifierToUid', identifierToUid)
+        result = yield self.call_perspective_commandline(
+            'get', None, None, ['x@y', 'x@y'], None)
+
+        identifierToUid.assert_called_once_with(identifier='x@y')
+        user_format = ('bb_username: None\n'
+                       'git: x <x@y>\nidentifier: x@y\n'
+                       'uid: 1\n\n')
+        self.assertEqual(result, 'user(s) found:\n' + user_format * 2)
+
+    @defer.inlineCallbacks
+    def test_perspective_commandline_update_duplicate_ids(self):
+        yield self.call_perspective_commandline(
+            'add', None, None, None, [{'identifier': 'x', 'svn': 'x'}])
+        yield self.call_perspective_commandline(
+            'update', None, None, None,
+            [{'identifier': 'x', 'svn': 'y'},
+             {'identifier': 'x', 'svn': 'z'}])
+
+        usdict = yield self.master.db.users.getUser(1)
+        self.assertEqual(usdict['svn'], 'z')
+
+    @defer.inlineCallbacks
+    def test_perspective_commandline_remove_duplicate_ids(self):
+        yield self.call_perspective_commandline(
+            'add', None, None, None, [{'identifier': 'x', 'svn': 'x'}])
+        removeUser = mock.Mock(side_effect=self.master.db.users.removeUser)
+        self.patch(self.master.db.users, 'removeUser', removeUser)
+        result = yield self.call_perspective_commandline(
+            'remove', None, None, ['x', 'x'], None)
+
+        removeUser.assert_called_once_with(1)
+        self.assertEqual(result, 'user(s) removed:\nidentifier: x\n')
+
+    @defer.inlineCallbacks
+    def test_perspective_commandline_remove_error(self):
+        yield self.call_perspective_commandline(
+            'add', None, None, None, [{'identifier': 'x', 'svn': 'x'}])
+        self.patch(self.master.db.users, 'removeUser',
+                   lambda uid: defer.fail(RuntimeError('oh noes')))
+        d = self.call_perspective_commandline(
+            'remove', None, None, ['x'], None)
+
+        # the DB error itself reaches the client, not a FirstError
+        yield self.assertFailure(d, RuntimeError)
+
+    @defer.inlineCallbacks
+    def test_perspective_commandline_update_error(self):
+        yield self.call_perspective_commandline(
+            'add', None, None, None, [{'identifier': 'x', 'svn': 'x'}])
+        self.patch(self.master.db.users, 'updateUser',
+                   lambda **kwargs: defer.fail(RuntimeError('oh noes')))
+        d = self.call_perspective_commandline(
+            'update', None, None, None, [{'identifier': 'x', 'svn': 'y'}])
+        yield self.assertFailure(d, RuntimeError)
+
+    def test_gatherPerKey(self):
+        persp = manual.CommandlineUserManagerPerspective(self.master)
+        calls = []
+
+        def call(name):
+            d = defer.Deferred()
+            calls.append((name, d))
+            return d
+        d = persp._gatherPerKey([('a', lambda: call('a1')),
+                                 ('b', lambda: call('b1')),
+                                 ('a', lambda: call('a2'))])
+
+        # a2 waits for a1 to finish, but b1 does not
+        self.assertEqual([name for name, _ in calls], ['a1', 'b1'])
+        calls[1][1].callback('B1')
+        calls[0][1].callback('A1')
+        self.assertEqual([name for name, _ in calls], ['a1', 'b1', 'a2'])
+        calls[2][1].callback('A2')
+
+        d.addCallback(self.assertEqual, ['A1', 'B1', 'A2'])
+        return d
+
 
 class TestCommandlineUserManager(unittest.TestCase, ManualUsersMixin):
 
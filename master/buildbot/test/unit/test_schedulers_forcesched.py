@@ -18,7 +18,7 @@ from __future__ import division
 from __future__ import print_function
 from future.utils import iteritems
 
-import json
+import pprint
 
 from twisted.internet import defer
 from twisted.trial import unittest
@@ -43,13 +43,65 @@ from buildbot.test.util.warnings import assertProducesWarning
 from buildbot.worker_transition import DeprecatedWorkerNameWarning
 
 
+def _spec(**kwargs):
+    # the spec keys shared by all the parameters tested here
+    spec = {"regex": None, "multiple": False, "name": "p1", "default": "",
+            "required": False, "label": "p1", "tablabel": "p1",
+            "hide": False, "fullName": "p1"}
+    spec.update(kwargs)
+    return spec
+
+
+STRING_SPEC = _spec(type="text", size=10)
+INT_SPEC = _spec(type="int", size=10, default=0)
+FIXED_SPEC = _spec(type="fixed", default="321", hide=True)
+BOOLEAN_SPEC = _spec(type="bool")
+USERNAME_SPEC = _spec(type="username", size=30, need_email=True,
+                      name="username", fullName="username",
+                      label="Your name:", tablabel="Your name:")
+CHOICE_SPEC = _spec(type="list", strict=True, choices=["t1", "t2"])
+CHOICE_MULTIPLE_SPEC = _spec(type="list", strict=True, choices=["t1", "t2"],
+                             multiple=True)
+NESTED_SPEC = _spec(type="nested", columns=1, layout="vertical", fields=[
+    _spec(type="int", size=10, default=0, name="foo", label="foo",
+          tablabel="foo", fullName="p1_foo")])
+
+# the properties and sourcestamp of a build forced by 'user' because 'because',
+# with no sourcestamp parameters
+OWNER_REASON = {
+    u'owner': ('user', u'Force Build Form'),
+    u'reason': ('because', u'Force Build Form'),
+}
+EMPTY_STAMP = {'branch': '', 'project': '', 'repository': '',
+               'revision': '', 'codebase': ''}
+
+# requests for the nested parameter tests; force() gets them as keyword
+# arguments, so they are never modified
+NESTED_NESTED_REQ = dict(p1_foo='123',
+                         p1_inner_str="bar",
+                         p1_inner_any_name="hello",
+                         p1_inner_any_value="world",
+                         reason="because")
+NESTED_NULLNAME_REQ = dict(foo='123',
+                           inner_str="bar",
+                           inner_name="hello",
+                           inner_value="world",
+                           reason="because",
+                           bar_a_name="a",
+                           bar_a_value="7",
+                           bar_b_name="b",
+                           bar_b_value="8")
+
+
 class TestForceScheduler(scheduler.SchedulerMixin, ConfigErrorsMixin, unittest.TestCase):
 
     OBJECTID = 19
     SCHEDULERID = 9
 
     def setUp(self):
-        self.setUpScheduler()
+        # the forced buildsets are recorded by the mixin, so the data API is
+        # not needed
+        self.setUpScheduler(wantData=False)
 
     def tearDown(self):
         self.tearDownScheduler()
@@ -67,75 +119,20 @@ class TestForceScheduler(scheduler.SchedulerMixin, ConfigErrorsMixin, unittest.T
 
         return sched
 
-    # tests
-
-    def test_compare_branch(self):
-        self.assertNotEqual(
-            ForceScheduler(name="testched", builderNames=[]),
-            ForceScheduler(
-                name="testched", builderNames=[],
-                codebases=oneCodebase(
-                    branch=FixedParameter("branch", "fishing/pole"))))
-
-    def test_compare_reason(self):
-        self.assertNotEqual(
-            ForceScheduler(name="testched", builderNames=[],
-                           reason=FixedParameter("reason", "no fish for you!")),
-            ForceScheduler(name="testched", builderNames=[],
-                           reason=FixedParameter("reason", "thanks for the fish!")))
-
-    def test_compare_revision(self):
-        self.assertNotEqual(
-            ForceScheduler(
-                name="testched", builderNames=[],
-                codebases=oneCodebase(
-                    revision=FixedParameter("revision", "fish-v1"))),
-            ForceScheduler(
-                name="testched", builderNames=[],
-                codebases=oneCodebase(
-                    revision=FixedParameter("revision", "fish-v2"))))
-
-    def test_compare_repository(self):
-        self.assertNotEqual(
-            ForceScheduler(
-                name="testched", builderNames=[],
-                codebases=oneCodebase(
-                    repository=FixedParameter("repository", "git://pond.org/fisher.git"))),
-            ForceScheduler(
-                name="testched", builderNames=[],
-                codebases=oneCodebase(
-                    repository=FixedParameter("repository", "svn://ocean.com/trawler/"))))
-
-    def test_compare_project(self):
-        self.assertNotEqual(
-            ForceScheduler(
-                name="testched", builderNames=[],
-                codebases=oneCodebase(
-                    project=FixedParameter("project", "fisher"))),
-            ForceScheduler(
-                name="testched", builderNames=[],
-                codebases=oneCodebase(
-                    project=FixedParameter("project", "trawler"))))
-
-    def test_compare_username(self):
-        self.assertNotEqual(
-            ForceScheduler(name="testched", builderNames=[]),
-            ForceScheduler(name="testched", builderNames=[],
-                           username=FixedParameter("username", "The Fisher King <avallach@atlantis.al>")))
-
-    def test_compare_properties(self):
-        self.assertNotEqual(
-            ForceScheduler(name="testched", builderNames=[],
-                           properties=[]),
-            ForceScheduler(name="testched", builderNames=[],
-                           properties=[FixedParameter("prop", "thanks for the fish!")]))
+    def assertBuildsetCall(self, builderNames, sourcestamps,
+                           properties=OWNER_REASON,
+                           reason=u"A build was forced by 'user': because"):
+        # forced builds add a single buildset, never waited for
+        self.assertEqual(self.addBuildsetCalls, [
+            ('addBuildsetForSourceStampsWithDefaults', dict(
+                builderNames=builderNames,
+                waited_for=False,
+                properties=properties,
+                reason=reason,
+                sourcestamps=sourcestamps)),
+        ])
 
-    def test_compare_codebases(self):
-        self.assertNotEqual(
-            ForceScheduler(name="testched", builderNames=[],
-                           codebases=['bar']),
-            ForceScheduler(name="testched", builderNames=[],
-                           codebases=['foo']))
+    # tests
 
     @defer.inlineCallbacks
     def test_basicForce(self):
@@ -147,19 +144,9 @@ class TestForceScheduler(scheduler.SchedulerMixin, ConfigErrorsMixin, unittest.T
 
         # only one builder forced, so there should only be one brid
         self.assertEqual(res, (500, {1000: 100}))
-        self.assertEqual(self.addBuildsetCalls, [
-            ('addBuildsetForSourceStampsWithDefaults', dict(
-                builderNames=['a'],
-                waited_for=False,
-                properties={
-                    u'owner': ('user', u'Force Build Form'),
-                    u'reason': ('because', u'Force Build Form'),
-                },
-                reason=u"A build was forced by 'user': because",
-                sourcestamps=[
-                    {'codebase': '', 'branch': 'a', 'revision': 'c',
-                     'repository': 'd', 'project': 'p'},
-                ])),
+        self.assertBuildsetCall(['a'], [
+            {'codebase': '', 'branch': 'a', 'revision': 'c',
+             'repository': 'd', 'project': 'p'},
         ])
 
     @defer.inlineCallbacks
@@ -176,19 +163,10 @@ class TestForceScheduler(scheduler.SchedulerMixin, ConfigErrorsMixin, unittest.T
         # only one builder forced, so there should only be one brid
         self.assertEqual(len(brids), 1)
 
-        self.assertEqual(self.addBuildsetCalls, [
-            ('addBuildsetForSourceStampsWithDefaults', {
-                'builderNames': ['a'],
-                'properties': {u'owner': ('user', u'Force Build Form'),
-                               u'reason': ('because', u'Force Build Form')},
-                'reason': 'user wants it because',
-                'sourcestamps': [{'branch': 'a',
-                                  'codebase': '',
-                                  'project': 'p',
-                                  'repository': 'd',
-                                  'revision': 'c'}],
-                'waited_for': False}),
-        ])
+        self.assertBuildsetCall(['a'], [
+            {'codebase': '', 'branch': 'a', 'revision': 'c',
+             'repository': 'd', 'project': 'p'},
+        ], reason='user wants it because')
         (bsid,
          dict(reason="user wants it because",
               brids=brids,
@@ -211,19 +189,9 @@ class TestForceScheduler(scheduler.SchedulerMixin, ConfigErrorsMixin, unittest.T
                                 repository='d', project='p',
                                 )
         self.assertEqual(res, (500, {1000: 100, 1001: 101}))
-        self.assertEqual(self.addBuildsetCalls, [
-            ('addBuildsetForSourceStampsWithDefaults', dict(
-                builderNames=['a', 'b'],
-                waited_for=False,
-                properties={
-                    u'owner': ('user', u'Force Build Form'),
-                    u'reason': ('because', u'Force Build Form'),
-                },
-                reason=u"A build was forced by 'user': because",
-                sourcestamps=[
-                    {'codebase': '', 'branch': 'a', 'revision': 'c',
-                     'repository': 'd', 'project': 'p'},
-                ])),
+        self.assertBuildsetCall(['a', 'b'], [
+            {'codebase': '', 'branch': 'a', 'revision': 'c',
+             'repository': 'd', 'project': 'p'},
         ])
 
     @defer.inlineCallbacks
@@ -235,19 +203,9 @@ class TestForceScheduler(scheduler.SchedulerMixin, ConfigErrorsMixin, unittest.T
                                 repository='d', project='p',
                                 )
         self.assertEqual(res, (500, {1000: 100, 1001: 101}))
-        self.assertEqual(self.addBuildsetCalls, [
-            ('addBuildsetForSourceStampsWithDefaults', dict(
-                builderNames=['a', 'b'],
-                waited_for=False,
-                properties={
-                    u'owner': ('user', u'Force Build Form'),
-                    u'reason': ('because', u'Force Build Form'),
-                },
-                reason=u"A build was forced by 'user': because",
-                sourcestamps=[
-                    {'codebase': '', 'branch': 'a', 'revision': 'c',
-                     'repository': 'd', 'project': 'p'},
-                ])),
+        self.assertBuildsetCall(['a', 'b'], [
+            {'codebase': '', 'branch': 'a', 'revision': 'c',
+             'repository': 'd', 'project': 'p'},
         ])
 
     def test_bad_codebases(self):
@@ -288,38 +246,21 @@ class TestForceScheduler(scheduler.SchedulerMixin, ConfigErrorsMixin, unittest.T
                                 )
 
         bsid, brids = res
-        expProperties = {
-            u'owner': ('user', 'Force Build Form'),
-            u'reason': ('because', 'Force Build Form'),
-        }
-        self.assertEqual(self.addBuildsetCalls, [
-            ('addBuildsetForSourceStampsWithDefaults', dict(
-                builderNames=['a'],
-                waited_for=False,
-                properties=expProperties,
-                reason=u"A build was forced by 'user': because",
-                sourcestamps=[
-                    {'branch': 'a', 'project': 'p', 'repository': 'd',
-                        'revision': 'c', 'codebase': 'foo'},
-                    {'branch': 'a2', 'project': 'p2', 'repository': 'd2',
-                        'revision': 'c2', 'codebase': 'bar'},
-                ])),
+        self.assertBuildsetCall(['a'], [
+            {'branch': 'a', 'project': 'p', 'repository': 'd',
+             'revision': 'c', 'codebase': 'foo'},
+            {'branch': 'a2', 'project': 'p2', 'repository': 'd2',
+             'revision': 'c2', 'codebase': 'bar'},
         ])
 
-    def formatJsonForTest(self, gotJson):
-        ret = ""
-        linestart = "expectJson='"
-        spaces = 7 * 4 + 2
-        while len(gotJson) > (90 - spaces):
-            gotJson = " " * spaces + linestart + gotJson
-            pos = gotJson[:100].rfind(",")
-            if pos > 0:
-                pos += 2
-            ret += gotJson[:pos] + "'\n"
-            gotJson = gotJson[pos:]
-            linestart = "'"
-        ret += " " * spaces + linestart + gotJson + "')\n"
-        return ret
+    def formatSpecForTest(self, gotSpec):
+        # render gotSpec as an expectSpec argument, wrapped to 100 characters
+        indent = " " * (7 * 4 + 2)
+        prefix = indent + "expectSpec="
+        lines = pprint.pformat(gotSpec, width=100 - len(prefix)).split("\n")
+        lines = [prefix + lines[0]] + \
+            [" " * len(prefix) + line for line in lines[1:]]
+        return "\n".join(lines) + ")\n"
 
     # value = the value to be sent with the parameter (ignored if req is set)
     # expect = the expected result (can be an exception type)
@@ -333,7 +274,7 @@ class TestForceScheduler(scheduler.SchedulerMixin, ConfigErrorsMixin, unittest.T
                          expectKind=None,
                          owner='user',
                          value=None, req=None,
-                         expectJson=None,
+                         expectSpec=None,
                          **kwargs):
 
         name = kwargs.setdefault('name', 'p1')
@@ -346,14 +287,12 @@ class TestForceScheduler(scheduler.SchedulerMixin, ConfigErrorsMixin, unittest.T
 
         self.assertEqual(prop.name, name)
         self.assertEqual(prop.label, kwargs.get('label', prop.name))
-        if expectJson is not None:
+        if expectSpec is not None:
             gotSpec = prop.getSpec()
-            gotJson = json.dumps(gotSpec)
-            expectSpec = json.loads(expectJson)
             if gotSpec != expectSpec:
                 try:
                     import xerox
-                    formated = self.formatJsonForTest(gotJson)
+                    formated = self.formatSpecForTest(gotSpec)
                     print(
                         "You may update the test with (copied to clipboard):\n" + formated)
                     xerox.copy(formated)
@@ -362,7 +301,8 @@ class TestForceScheduler(scheduler.SchedulerMixin, ConfigErrorsMixin, unittest.T
                     print("Note: for quick fix, pip install xerox")
             self.assertEqual(gotSpec, expectSpec)
 
-        sched = self.makeScheduler(properties=[prop])
+        # only builder a is forced, so there is no need for b
+        sched = self.makeScheduler(properties=[prop], builderNames=['a'])
 
         if not req:
             req = {name: value, 'reason': 'because'}
@@ -377,10 +317,7 @@ class TestForceScheduler(scheduler.SchedulerMixin, ConfigErrorsMixin, unittest.T
                 raise
             defer.returnValue(None)  # success
 
-        expect_props = {
-            'owner': ('user', 'Force Build Form'),
-            'reason': ('because', 'Force Build Form'),
-        }
+        expect_props = dict(OWNER_REASON)
 
         if expectKind is None:
             expect_props[name] = (expect, 'Force Build Form')
@@ -392,185 +329,153 @@ class TestForceScheduler(scheduler.SchedulerMixin, ConfigErrorsMixin, unittest.T
 
         # only forced on 'a'
         self.assertEqual((bsid, brids), (500, {1000: 100}))
-        self.assertEqual(self.addBuildsetCalls, [
-            ('addBuildsetForSourceStampsWithDefaults', dict(
-                builderNames=['a'],
-                waited_for=False,
-                properties=expect_props,
-                reason=u"A build was forced by 'user': because",
-                sourcestamps=[
-                    {'branch': '', 'project': '', 'repository': '',
-                     'revision': '', 'codebase': ''},
-                ])),
-        ])
+        self.assertBuildsetCall(['a'], [EMPTY_STAMP],
+                                properties=expect_props)
 
     def test_StringParameter(self):
-        self.do_ParameterTest(value="testedvalue", expect="testedvalue",
-                              klass=StringParameter,
-                              expectJson='{"regex": null, "multiple": false, "name": "p1", '
-                              '"default": "", "required": false, "label": "p1", "tablabel": "p1", '
-                              '"hide": false, "fullName": "p1", "type": "text", "size": 10}')
+        return self.do_ParameterTest(value="testedvalue", expect="testedvalue",
+                                     klass=StringParameter,
+                                     expectSpec=STRING_SPEC)
 
     def test_StringParameter_Required(self):
-        self.do_ParameterTest(value=" ", expect=CollectedValidationError,
-                              expectKind=Exception,
-                              klass=StringParameter, required=True)
+        return self.do_ParameterTest(value=" ", expect=CollectedValidationError,
+                                     expectKind=Exception,
+                                     klass=StringParameter, required=True)
 
     def test_IntParameter(self):
-        self.do_ParameterTest(value="123", expect=123, klass=IntParameter,
-                              expectJson='{"regex": null, "multiple": false, "name": "p1", '
-                              '"default": 0, "required": false, "label": "p1", "tablabel": "p1", '
-                              '"hide": false, "fullName": "p1", "type": "int", "size": 10}')
+        return self.do_ParameterTest(value="123", expect=123, klass=IntParameter,
+                                     expectSpec=INT_SPEC)
 
     def test_FixedParameter(self):
-        self.do_ParameterTest(value="123", expect="321", klass=FixedParameter,
-                              default="321",
-                              expectJson='{"regex": null, "multiple": false, "name": "p1", '
-                              '"default": "321", "required": false, "label": "p1", "tablabel": "p1", '
-                              '"hide": true, "fullName": "p1", "type": "fixed"}')
+        return self.do_ParameterTest(value="123", expect="321", klass=FixedParameter,
+                                     default="321",
+                                     expectSpec=FIXED_SPEC)
 
     def test_BooleanParameter_True(self):
         req = dict(p1=True, reason='because')
-        self.do_ParameterTest(value="123", expect=True, klass=BooleanParameter,
-                              req=req,
-                              expectJson='{"regex": null, "multiple": false, "name": "p1", '
-                              '"default": "", "required": false, "label": "p1", "tablabel": "p1", '
-                              '"hide": false, "fullName": "p1", "type": "bool"}')
+        return self.do_ParameterTest(value="123", expect=True, klass=BooleanParameter,
+                                     req=req,
+                                     expectSpec=BOOLEAN_SPEC)
 
     def test_BooleanParameter_False(self):
         req = dict(p2=True, reason='because')
-        self.do_ParameterTest(value="123", expect=False,
-                              klass=BooleanParameter, req=req)
+        return self.do_ParameterTest(value="123", expect=False,
+                                     klass=BooleanParameter, req=req)
 
     def test_UserNameParameter(self):
         email = "test <test@buildbot.net>"
-        self.do_ParameterTest(value=email, expect=email,
-                              klass=UserNameParameter(),
-                              name="username", label="Your name:",
-                              expectJson='{"regex": null, "need_email": true, "multiple": false, '
-                              '"name": "username", "default": "", "required": false, '
-                              '"label": "Your name:", "tablabel": "Your name:", "hide": false, '
-                              '"fullName": "username", "type": "username", "size": 30}')
+        return self.do_ParameterTest(value=email, expect=email,
+                                     klass=UserNameParameter(),
+                                     name="username", label="Your name:",
+                                     expectSpec=USERNAME_SPEC)
 
     def test_UserNameParameterIsValidMail(self):
         email = "test@buildbot.net"
-        self.do_ParameterTest(value=email, expect=email,
-                              klass=UserNameParameter(),
-                              name="username", label="Your name:",
-                              expectJson='{"regex": null, "need_email": true, "multiple": false, '
-                              '"name": "username", "default": "", "required": false, '
-                              '"label": "Your name:", "tablabel": "Your name:", "hide": false, '
-                              '"fullName": "username", "type": "username", "size": 30}')
+        return self.do_ParameterTest(value=email, expect=email,
+                                     klass=UserNameParameter(),
+                                     name="username", label="Your name:",
+                                     expectSpec=USERNAME_SPEC)
 
     def test_UserNameParameterIsValidMailBis(self):
         email = "<test@buildbot.net>"
-        self.do_ParameterTest(value=email, expect=email,
-                              klass=UserNameParameter(),
-                              name="username", label="Your name:",
-                              expectJson='{"regex": null, "need_email": true, "multiple": false, '
-                              '"name": "username", "default": "", "required": false, '
-                              '"label": "Your name:", "tablabel": "Your name:", "hide": false, '
-                              '"fullName": "username", "type": "username", "size": 30}')
+        return self.do_ParameterTest(value=email, expect=email,
+                                     klass=UserNameParameter(),
+                                     name="username", label="Your name:",
+                                     expectSpec=USERNAME_SPEC)
+
+    # the choice tests only read their parameter, so each configuration is
+    # built once; debug is off so that the rejected values are not logged
+    CHOICE_STRICT = ChoiceStringParameter(name='p1', choices=['t1', 't2'],
+                                          debug=False)
+    CHOICE_NOTSTRICT = ChoiceStringParameter(name='p1', choices=['t1', 't2'],
+                                             strict=False)
+    CHOICE_MULTIPLE = ChoiceStringParameter(name='p1', choices=['t1', 't2'],
+                                            multiple=True, debug=False)
 
     def test_ChoiceParameter(self):
-        self.do_ParameterTest(value='t1', expect='t1',
-                              klass=ChoiceStringParameter, choices=[
-                                  't1', 't2'],
-                              expectJson='{"regex": null, "multiple": false, "name": "p1", '
-                              '"default": "", "required": false, "label": "p1", "strict": true, '
-                              '"tablabel": "p1", "hide": false, "fullName": "p1", "choices": ["t1", '
-                              '"t2"], "type": "list"}')
+        return self.do_ParameterTest(value='t1', expect='t1',
+                                     klass=self.CHOICE_STRICT,
+                                     expectSpec=CHOICE_SPEC)
 
     def test_ChoiceParameterError(self):
-        self.do_ParameterTest(value='t3',
-                              expect=CollectedValidationError,
-                              expectKind=Exception,
-                              klass=ChoiceStringParameter, choices=[
-                                  't1', 't2'],
-                              debug=False)
+        return self.do_ParameterTest(value='t3',
+                                     expect=CollectedValidationError,
+                                     expectKind=Exception,
+                                     klass=self.CHOICE_STRICT)
 
     def test_ChoiceParameterError_notStrict(self):
-        self.do_ParameterTest(value='t1', expect='t1',
-                              strict=False,
-                              klass=ChoiceStringParameter, choices=['t1', 't2'])
+        return self.do_ParameterTest(value='t1', expect='t1',
+                                     klass=self.CHOICE_NOTSTRICT)
 
     def test_ChoiceParameterMultiple(self):
-        self.do_ParameterTest(value=['t1', 't2'], expect=['t1', 't2'],
-                              klass=ChoiceStringParameter, choices=['t1', 't2'], multiple=True,
-                              expectJson='{"regex": null, "multiple": true, "name": "p1", '
-                              '"default": "", "required": false, "label": "p1", "strict": true, '
-                              '"tablabel": "p1", "hide": false, "fullName": "p1", "choices": ["t1", '
-                              '"t2"], "type": "list"}')
+        return self.do_ParameterTest(value=['t1', 't2'], expect=['t1', 't2'],
+                                     klass=self.CHOICE_MULTIPLE,
+                                     expectSpec=CHOICE_MULTIPLE_SPEC)
 
     def test_ChoiceParameterMultipleError(self):
-        self.do_ParameterTest(value=['t1', 't3'],
-                              expect=CollectedValidationError,
-                              expectKind=Exception,
-                              klass=ChoiceStringParameter, choices=[
-                                  't1', 't2'],
-                              multiple=True, debug=False)
+        return self.do_ParameterTest(value=['t1', 't3'],
+                                     expect=CollectedValidationError,
+                                     expectKind=Exception,
+                                     klass=self.CHOICE_MULTIPLE)
+
+    # the nested tests wrap these field trees in a new parent named the same
+    # each time, which is all that is ever set on the fields, so the trees
+    # are built once
+    NESTED_FIELDS = (
+        IntParameter(name="foo"),
+    )
+
+    NESTED_NESTED_FIELDS = (
+        NestedParameter(name="inner", fields=[
+            StringParameter(name='str'),
+            AnyPropertyParameter(name='any')
+        ]),
+        IntParameter(name="foo"),
+    )
+
+    # same as above except "p1" and "any" are skipped
+    NESTED_NULLNAME_FIELDS = (
+        NestedParameter(name="inner", fields=[
+            StringParameter(name='str'),
+            AnyPropertyParameter(name='')
+        ]),
+        IntParameter(name="foo"),
+        NestedParameter(name='bar', fields=[
+            NestedParameter(
+                name='', fields=[AnyPropertyParameter(name='a')]),
+            NestedParameter(
+                name='', fields=[AnyPropertyParameter(name='b')])
+        ]),
+    )
 
     def test_NestedParameter(self):
-        fields = [
-            IntParameter(name="foo")
-        ]
-        self.do_ParameterTest(req=dict(p1_foo='123', reason="because"),
-                              expect=dict(foo=123),
-                              klass=NestedParameter, fields=fields,
-                              expectJson='{"regex": null, "multiple": false, "name": "p1", '
-                              '"default": "", "fields": [{"regex": null, "multiple": false, '
-                              '"name": "foo", "default": 0, "required": false, "label": "foo", '
-                              '"tablabel": "foo", "hide": false, "fullName": "p1_foo", '
-                              '"type": "int", "size": 10}], "required": false, "label": "p1", '
-                              '"tablabel": "p1", "hide": false, "fullName": "p1", "type": "nested", '
-                              '"columns": 1, "layout": "vertical"}')
+        return self.do_ParameterTest(req=dict(p1_foo='123', reason="because"),
+                                     expect=dict(foo=123),
+                                     klass=NestedParameter,
+                                     fields=self.NESTED_FIELDS,
+                                     expectSpec=NESTED_SPEC)
 
     def test_NestedNestedParameter(self):
-        fields = [
-            NestedParameter(name="inner", fields=[
-                StringParameter(name='str'),
-                AnyPropertyParameter(name='any')
-            ]),
-            IntParameter(name="foo")
-        ]
-        self.do_ParameterTest(req=dict(p1_foo='123',
-                                       p1_inner_str="bar",
-                                       p1_inner_any_name="hello",
-                                       p1_inner_any_value="world",
-                                       reason="because"),
-                              expect=dict(
-                                  foo=123, inner=dict(str="bar", hello="world")),
-                              klass=NestedParameter, fields=fields)
+        return self.do_ParameterTest(req=NESTED_NESTED_REQ,
+                                     expect=dict(
+                                         foo=123, inner=dict(str="bar", hello="world")),
+                                     klass=NestedParameter,
+                                     fields=self.NESTED_NESTED_FIELDS)
 
     def test_NestedParameter_nullname(self):
-        # same as above except "p1" and "any" are skipped
-        fields = [
-            NestedParameter(name="inner", fields=[
-                StringParameter(name='str'),
-                AnyPropertyParameter(name='')
-            ]),
-            IntParameter(name="foo"),
-            NestedParameter(name='bar', fields=[
-                NestedParameter(
-                    name='', fields=[AnyPropertyParameter(name='a')]),
-                NestedParameter(
-                    name='', fields=[AnyPropertyParameter(name='b')])
-            ])
-        ]
-        self.do_ParameterTest(req=dict(foo='123',
-                                       inner_str="bar",
-                                       inner_name="hello",
-                                       inner_value="world",
-                                       reason="because",
-                                       bar_a_name="a",
-                                       bar_a_value="7",
-                                       bar_b_name="b",
-                                       bar_b_value="8"),
-                              expect=dict(foo=123,
-                                          inner=dict(str="bar", hello="world"),
-                                          bar={'a': '7', 'b': '8'}),
-                              expectKind=dict,
-                              klass=NestedParameter, fields=fields, name='')
+        return self.do_ParameterTest(req=NESTED_NULLNAME_REQ,
+                                     expect=dict(foo=123,
+                                                 inner=dict(str="bar", hello="world"),
+                                                 bar={'a': '7', 'b': '8'}),
+                                     expectKind=dict,
+                                     klass=NestedParameter,
+                                     fields=self.NESTED_NULLNAME_FIELDS, name='')
+
+    # matched as substrings of the reported error by assertRaisesConfigError
+    BAD_BUILDERNAMES_ERROR = \
+        "ForceScheduler 'testsched': builderNames must be a list of strings:"
+    BAD_PROPERTIES_ERROR = \
+        "ForceScheduler 'testsched': properties must be a list of BaseParameters:"
 
     def test_bad_reason(self):
         self.assertRaisesConfigError("ForceScheduler 'testsched': reason must be a StringParameter",
@@ -600,12 +505,12 @@ class TestForceScheduler(scheduler.SchedulerMixin, ConfigErrorsMixin, unittest.T
                                                             codebases=['bar'], username="foo"))
 
     def test_integer_builderNames(self):
-        self.assertRaisesConfigError("ForceScheduler 'testsched': builderNames must be a list of strings:",
+        self.assertRaisesConfigError(self.BAD_BUILDERNAMES_ERROR,
                                      lambda: ForceScheduler(name='testsched', builderNames=1234,
                                                             codebases=['bar'], username="foo"))
 
     def test_listofints_builderNames(self):
-        self.assertRaisesConfigError("ForceScheduler 'testsched': builderNames must be a list of strings:",
+        self.assertRaisesConfigError(self.BAD_BUILDERNAMES_ERROR,
                                      lambda: ForceScheduler(name='testsched', builderNames=[1234],
                                                             codebases=['bar'], username="foo"))
 
@@ -613,36 +518,91 @@ class TestForceScheduler(scheduler.SchedulerMixin, ConfigErrorsMixin, unittest.T
         ForceScheduler(name='testsched', builderNames=[u'a', u'b'])
 
     def test_listofmixed_builderNames(self):
-        self.assertRaisesConfigError("ForceScheduler 'testsched': builderNames must be a list of strings:",
+        self.assertRaisesConfigError(self.BAD_BUILDERNAMES_ERROR,
                                      lambda: ForceScheduler(name='testsched',
                                                             builderNames=[
                                                                 'test', 1234],
                                                             codebases=['bar'], username="foo"))
 
-    def test_integer_properties(self):
-        self.assertRaisesConfigError("ForceScheduler 'testsched': properties must be a list of BaseParameters:",
-                                     lambda: ForceScheduler(name='testsched', builderNames=[],
-                                                            codebases=['bar'], username="foo",
-                                                            properties=1234))
-
-    def test_listofints_properties(self):
-        self.assertRaisesConfigError("ForceScheduler 'testsched': properties must be a list of BaseParameters:",
-                                     lambda: ForceScheduler(name='testsched', builderNames=[],
-                                                            codebases=['bar'], username="foo",
-                                                            properties=[1234, 2345]))
-
-    def test_listofmixed_properties(self):
-        self.assertRaisesConfigError("ForceScheduler 'testsched': properties must be a list of BaseParameters:",
-                                     lambda: ForceScheduler(name='testsched', builderNames=[],
-                                                            codebases=['bar'], username="foo",
-                                                            properties=[BaseParameter(name="test",),
-                                                                        4567]))
+    def test_bad_properties(self):
+        for properties in [1234,
+                           [1234, 2345],
+                           [BaseParameter(name="test"), 4567]]:
+            self.assertRaisesConfigError(
+                self.BAD_PROPERTIES_ERROR,
+                lambda properties=properties: ForceScheduler(
+                    name='testsched', builderNames=[],
+                    codebases=['bar'], username="foo",
+                    properties=properties))
 
     def test_novalue_to_parameter(self):
         self.assertRaisesConfigError("Use default='1234' instead of value=... to give a default Parameter value",
                                      lambda: BaseParameter(name="test", value="1234"))
 
 
+def _sched(**overrides):
+    return ForceScheduler(name="testched", builderNames=[], **overrides)
+
+
+class TestForceSchedulerCompare(unittest.TestCase):
+
+    # these only compare schedulers, so they need no master
+
+    _defaultSched = None
+
+    def defaultSched(self):
+        # comparing does not modify the scheduler, so the default one is
+        # built once and shared by all the tests
+        cls = self.__class__
+        if cls._defaultSched is None:
+            cls._defaultSched = _sched()
+        return cls._defaultSched
+
+    def test_compare_branch(self):
+        self.assertNotEqual(
+            self.defaultSched(),
+            _sched(codebases=oneCodebase(
+                branch=FixedParameter("branch", "fishing/pole"))))
+
+    def test_compare_reason(self):
+        self.assertNotEqual(
+            self.defaultSched(),
+            _sched(reason=FixedParameter("reason", "thanks for the fish!")))
+
+    def test_compare_revision(self):
+        self.assertNotEqual(
+            self.defaultSched(),
+            _sched(codebases=oneCodebase(
+                revision=FixedParameter("revision", "fish-v2"))))
+
+    def test_compare_repository(self):
+        self.assertNotEqual(
+            self.defaultSched(),
+            _sched(codebases=oneCodebase(
+                repository=FixedParameter("repository", "svn://ocean.com/trawler/"))))
+
+    def test_compare_project(self):
+        self.assertNotEqual(
+            self.defaultSched(),
+            _sched(codebases=oneCodebase(
+                project=FixedParameter("project", "trawler"))))
+
+    def test_compare_username(self):
+        self.assertNotEqual(
+            self.defaultSched(),
+            _sched(username=FixedParameter("username", "The Fisher King <avallach@atlantis.al>")))
+
+    def test_compare_properties(self):
+        self.assertNotEqual(
+            self.defaultSched(),
+            _sched(properties=[FixedParameter("prop", "thanks for the fish!")]))
+
+    def test_compare_codebases(self):
+        self.assertNotEqual(
+            _sched(codebases=['bar']),
+            _sched(codebases=['foo']))
+
+
 class TestWorkerTransition(unittest.TestCase):
 
     def test_BuildslaveChoiceParameter_deprecated(self):
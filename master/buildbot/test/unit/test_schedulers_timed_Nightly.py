@@ -23,7 +23,6 @@ import mock
 
 from twisted.internet import defer
 from twisted.internet import task
-from twisted.python import log
 from twisted.trial import unittest
 
 from buildbot.changes import filter
@@ -32,6 +31,24 @@ from buildbot.test.fake import fakedb
 from buildbot.test.util import scheduler
 
 
+def fII(change):
+    # the tests feed changes to gotChange directly, so this is never called;
+    # it is only checked to be what the scheduler consumes changes with
+    return True
+
+
+# the buildset a Nightly scheduler without onlyIfChanged adds on each firing
+DEFAULT_BUILDSET_CALL = ('addBuildsetForSourceStampsWithDefaults', {
+    'builderNames': None,
+    'sourcestamps': [{'codebase': ''}],
+    'properties': None,
+    'reason': u"The Nightly scheduler named 'test' triggered this build",
+    'waited_for': False})
+
+# filters are never changed once built, so the tests can share one
+FOO_FILTER = filter.ChangeFilter(category_re="fo+o")
+
+
 class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
 
     try:
@@ -49,33 +66,29 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
     # minutes past the hour) and subtracted before the time offset is reported.
     localtime_offset = time.timezone % 3600
 
+    # clock times of the builds the tests expect, as stored in last_build
+    AT_300 = localtime_offset + 300
+    AT_1260 = localtime_offset + 1260
+    AT_1500 = localtime_offset + 1500
+
     def makeScheduler(self, **kwargs):
+        # almost every test uses the same name and builder
+        kwargs.setdefault('name', 'test')
+        kwargs.setdefault('builderNames', ['test'])
         sched = self.attachScheduler(timed.Nightly(**kwargs),
                                      self.OBJECTID, self.SCHEDULERID,
                                      overrideBuildsetMethods=True)
 
         self.master.db.insertTestData(
-            [fakedb.Builder(name=bname) for bname in kwargs.get("builderNames", [])])
+            [fakedb.Builder(name=bname) for bname in kwargs["builderNames"]])
 
         # add a Clock to help checking timing issues
         self.clock = sched._reactor = task.Clock()
         self.clock.advance(self.localtime_offset)  # get to 0 min past the hour
 
+        # see fake_addBuildsetForXxx
         self.addBuildsetCallTimes = []
 
-        def recordTimes(timeList, method):
-            def timedMethod(**kw):
-                timeList.append(self.clock.seconds() - self.localtime_offset)
-                return method(**kw)
-            return timedMethod
-
-        sched.addBuildsetForSourceStampsWithDefaults = recordTimes(
-            self.addBuildsetCallTimes,
-            sched.addBuildsetForSourceStampsWithDefaults)
-        sched.addBuildsetForChanges = recordTimes(
-            self.addBuildsetCallTimes,
-            sched.addBuildsetForChanges)
-
         # see self.assertConsumingChanges
         self.consumingChanges = None
 
@@ -86,30 +99,25 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
 
         return sched
 
-    def mkbs(self, **kwargs):
-        # create buildset for expected_buildset in assertBuildset.
-        bs = dict(reason="The Nightly scheduler named 'test' triggered this build", external_idstring='', sourcestampsetid=100,
-                  properties=[('scheduler', ('test', 'Scheduler'))])
-        bs.update(kwargs)
-        return bs
-
-    def mkss(self, **kwargs):
-        # create sourcestamp for expected_sourcestamps in assertBuildset.
-        ss = dict(
-            branch='master', project='', repository='', sourcestampsetid=100)
-        ss.update(kwargs)
-        return ss
-
-    def mkch(self, **kwargs):
-        # create changeset and insert in database.
-        chd = dict(branch='master', project='', repository='')
-        chd.update(kwargs)
-        ch = self.makeFakeChange(**chd)
-        # fakedb.Change requires changeid instead of number
-        chd['changeid'] = chd['number']
-        del chd['number']
-        self.db.insertTestData([fakedb.Change(**chd)])
-        return ch
+    # record when the buildset methods are called, as seconds past the hour
+
+    def fake_addBuildsetForSourceStampsWithDefaults(self, reason, sourcestamps=None,
+                                                    waited_for=False, properties=None,
+                                                    builderNames=None, **kw):
+        self.addBuildsetCallTimes.append(
+            self.clock.seconds() - self.localtime_offset)
+        return scheduler.SchedulerMixin.fake_addBuildsetForSourceStampsWithDefaults(
+            self, reason, sourcestamps=sourcestamps, waited_for=waited_for,
+            properties=properties, builderNames=builderNames, **kw)
+
+    def fake_addBuildsetForChanges(self, waited_for=False, reason='', external_idstring=None,
+                                   changeids=None, builderNames=None, properties=None, **kw):
+        self.addBuildsetCallTimes.append(
+            self.clock.seconds() - self.localtime_offset)
+        return scheduler.SchedulerMixin.fake_addBuildsetForChanges(
+            self, waited_for=waited_for, reason=reason,
+            external_idstring=external_idstring, changeids=changeids,
+            builderNames=builderNames, properties=properties, **kw)
 
     def setUp(self):
         self.setUpScheduler()
@@ -120,33 +128,33 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
     def assertConsumingChanges(self, **kwargs):
         self.assertEqual(self.consumingChanges, kwargs)
 
-    # Tests
+    def advanceClockTo(self, seconds):
+        # run the clock forward to the given number of seconds past the hour,
+        # stopping only where a call is scheduled so that it runs at its time
+        until = self.localtime_offset + seconds
+        while self.clock.seconds() < until:
+            nextCall = min([call.getTime()
+                            for call in self.clock.getDelayedCalls()] + [until])
+            self.clock.advance(nextCall - self.clock.seconds())
 
-    def test_constructor_no_reason(self):
-        sched = self.makeScheduler(
-            name='test', builderNames=['test'], branch='default')
-        self.assertEqual(
-            sched.reason, "The Nightly scheduler named 'test' triggered this build")
-
-    def test_constructor_reason(self):
-        sched = self.makeScheduler(
-            name='test', builderNames=['test'], branch='default', reason="hourly")
-        self.assertEqual(sched.reason, "hourly")
-
-    def test_constructor_change_filter(self):
-        sched = self.makeScheduler(name='test', builderNames=['test'],
-                                   branch=None, change_filter=filter.ChangeFilter(category_re="fo+o"))
-        assert sched.change_filter
+    # Tests
 
-    def test_constructor_month(self):
-        sched = self.makeScheduler(
-            name='test', builderNames=['test'], branch='default', month='1')
-        self.assertEqual(sched.month, "1")
+    def test_constructor_attrs(self):
+        # the constructor only stores its arguments, so the schedulers need
+        # no master and one test can check them all
+        for kwargs, attr, expected in [
+                (dict(branch='default'), 'reason',
+                 "The Nightly scheduler named 'test' triggered this build"),
+                (dict(branch='default', reason="hourly"), 'reason', "hourly"),
+                (dict(branch=None, change_filter=FOO_FILTER),
+                 'change_filter', FOO_FILTER),
+                (dict(branch='default', month='1'), 'month', "1")]:
+            sched = timed.Nightly(name='test', builderNames=['test'], **kwargs)
+            self.assertEqual(getattr(sched, attr), expected)
 
     @defer.inlineCallbacks
     def test_enabled_callback(self):
-        sched = self.makeScheduler(
-            name='test', builderNames=['test'], branch='default')
+        sched = self.makeScheduler(branch='default')
         expectedValue = not sched.enabled
         yield sched._enabledCallback(None, {'enabled': not sched.enabled})
         self.assertEqual(sched.enabled, expectedValue)
@@ -156,8 +164,7 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
 
     @defer.inlineCallbacks
     def test_disabled_activate(self):
-        sched = self.makeScheduler(
-            name='test', builderNames=['test'], branch='default')
+        sched = self.makeScheduler(branch='default')
         yield sched._enabledCallback(None, {'enabled': not sched.enabled})
         self.assertEqual(sched.enabled, False)
         r = yield sched.activate()
@@ -165,8 +172,7 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
 
     @defer.inlineCallbacks
     def test_disabled_deactivate(self):
-        sched = self.makeScheduler(
-            name='test', builderNames=['test'], branch='default')
+        sched = self.makeScheduler(branch='default')
         yield sched._enabledCallback(None, {'enabled': not sched.enabled})
         self.assertEqual(sched.enabled, False)
         r = yield sched.deactivate()
@@ -174,8 +180,7 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
 
     @defer.inlineCallbacks
     def test_disabled_start_build(self):
-        sched = self.makeScheduler(
-            name='test', builderNames=['test'], branch='default')
+        sched = self.makeScheduler(branch='default')
         yield sched._enabledCallback(None, {'enabled': not sched.enabled})
         self.assertEqual(sched.enabled, False)
         r = yield sched.startBuild()
@@ -189,7 +194,7 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
         # starts at midnight UTC, so be careful not to use times that are
         # timezone dependent -- stick to minutes-past-the-half-hour, as some
         # timezones are multiples of 30 minutes off from UTC
-        sched = self.makeScheduler(name='test', builderNames=['test'], branch=None,
+        sched = self.makeScheduler(branch=None,
                                    minute=[10, 20, 21, 40, 50, 51])
 
         # add a change classification
@@ -201,95 +206,63 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
         # invocation has not requested onlyIfChanged
         self.db.schedulers.assertClassifications(self.SCHEDULERID, {})
 
-        self.clock.advance(0)  # let it get set up
-        while self.clock.seconds() < self.localtime_offset + 30 * 60:
-            self.clock.advance(60)
+        self.advanceClockTo(30 * 60)
         self.assertEqual(self.addBuildsetCallTimes, [600, 1200, 1260])
-        self.assertEqual(self.addBuildsetCalls, [
-            ('addBuildsetForSourceStampsWithDefaults', {
-                'builderNames': None,
-                'sourcestamps': [{'codebase': ''}],
-                'properties': None,
-                'reason': u"The Nightly scheduler named 'test' triggered this build",
-                'waited_for': False}),
-            ('addBuildsetForSourceStampsWithDefaults', {
-                'builderNames': None,
-                'sourcestamps': [{'codebase': ''}],
-                'properties': None,
-                'reason': u"The Nightly scheduler named 'test' triggered this build",
-                'waited_for': False}),
-            ('addBuildsetForSourceStampsWithDefaults', {
-                'builderNames': None,
-                'sourcestamps': [{'codebase': ''}],
-                'properties': None,
-                'reason': u"The Nightly scheduler named 'test' triggered this build",
-                'waited_for': False})])
+        self.assertEqual(self.addBuildsetCalls, [DEFAULT_BUILDSET_CALL] * 3)
         self.db.state.assertStateByClass('test', 'Nightly',
-                                         last_build=1260 + self.localtime_offset)
+                                         last_build=self.AT_1260)
 
         yield sched.deactivate()
 
     def test_iterations_simple_with_branch(self):
         # see timezone warning above
-        sched = self.makeScheduler(name='test', builderNames=['test'],
-                                   branch='master', minute=[5, 35])
+        sched = self.makeScheduler(branch='master', minute=[5, 35])
 
         sched.activate()
 
-        self.clock.advance(0)
-        while self.clock.seconds() < self.localtime_offset + 10 * 60:
-            self.clock.advance(60)
+        self.advanceClockTo(10 * 60)
         self.assertEqual(self.addBuildsetCallTimes, [300])
-        self.assertEqual(self.addBuildsetCalls, [
-            ('addBuildsetForSourceStampsWithDefaults', {
-                'builderNames': None,
-                'sourcestamps': [{'codebase': ''}],
-                'properties': None,
-                'reason': u"The Nightly scheduler named 'test' triggered this build",
-                'waited_for': False})])
+        self.assertEqual(self.addBuildsetCalls, [DEFAULT_BUILDSET_CALL])
         self.db.state.assertStateByClass('test', 'Nightly',
-                                         last_build=300 + self.localtime_offset)
+                                         last_build=self.AT_300)
 
         d = sched.deactivate()
         return d
 
     def do_test_iterations_onlyIfChanged(self, *changes_at, **kwargs):
-        fII = mock.Mock(name='fII')
-        self.makeScheduler(name='test', builderNames=['test'], branch=None,
-                           minute=[5, 25, 45], onlyIfChanged=True,
+        self.makeScheduler(branch=None, minute=[5, 25, 45], onlyIfChanged=True,
                            fileIsImportant=fII, **kwargs)
 
-        return self.do_test_iterations_onlyIfChanged_test(fII, *changes_at)
+        return self.do_test_iterations_onlyIfChanged_test(*changes_at)
 
     @defer.inlineCallbacks
-    def do_test_iterations_onlyIfChanged_test(self, fII, *changes_at):
+    def do_test_iterations_onlyIfChanged_test(self, *changes_at):
         yield self.sched.activate()
 
         # check that the scheduler has started to consume changes
         self.assertConsumingChanges(fileIsImportant=fII, change_filter=None,
                                     onlyImportant=False)
 
-        # manually run the clock forward through a half-hour, allowing any
-        # excitement to take place
-        changes_at = list(changes_at)
-        self.clock.advance(0)  # let it trigger the first build
-        while self.clock.seconds() < self.localtime_offset + 30 * 60:
-            # inject any new changes..
-            while (changes_at and
-                    self.clock.seconds() >=
-                   self.localtime_offset + changes_at[0][0]):
-                when, newchange, important = changes_at.pop(0)
-                self.db.changes.fakeAddChangeInstance(newchange)
-                yield self.sched.gotChange(newchange, important).addErrback(log.err)
-            # and advance the clock by a minute
-            self.clock.advance(60)
+        # the scheduler only learns about a change through gotChange, so
+        # they can all be put in the database up front
+        for when, newchange, important in changes_at:
+            self.db.changes.fakeAddChangeInstance(newchange)
+
+        # manually run the clock forward through a half-hour, injecting each
+        # change at its time and allowing any excitement to take place; the
+        # clock only moves forward, so inject the changes in time order
+        for when, newchange, important in sorted(changes_at,
+                                                 key=lambda c: c[0]):
+            self.advanceClockTo(when)
+            yield self.sched.gotChange(newchange, important)
+        self.advanceClockTo(30 * 60)
 
     @defer.inlineCallbacks
     def test_iterations_onlyIfChanged_no_changes(self):
         yield self.do_test_iterations_onlyIfChanged()
         self.assertEqual(self.addBuildsetCalls, [])
         self.db.state.assertStateByClass('test', 'Nightly',
-                                         last_build=1500 + self.localtime_offset)
+                                         last_build=self.AT_1500)
         yield self.sched.deactivate()
 
     @defer.inlineCallbacks
@@ -299,7 +272,7 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
             (600, mock.Mock(), False))
         self.assertEqual(self.addBuildsetCalls, [])
         self.db.state.assertStateByClass('test', 'Nightly',
-                                         last_build=1500 + self.localtime_offset)
+                                         last_build=self.AT_1500)
         yield self.sched.deactivate()
 
     @defer.inlineCallbacks
@@ -309,7 +282,7 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
             (1700, self.makeFakeChange(number=2, branch='staging'), True))
         self.assertEqual(self.addBuildsetCalls, [])
         self.db.state.assertStateByClass('test', 'Nightly',
-                                         last_build=1500 + self.localtime_offset)
+                                         last_build=self.AT_1500)
         yield self.sched.deactivate()
 
     @defer.inlineCallbacks
@@ -333,7 +306,7 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
                 'reason': u"The Nightly scheduler named 'test' triggered this build",
                 'waited_for': False})])
         self.db.state.assertStateByClass('test', 'Nightly',
-                                         last_build=1500 + self.localtime_offset)
+                                         last_build=self.AT_1500)
         yield self.sched.deactivate()
 
     @defer.inlineCallbacks
@@ -346,8 +319,6 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
             codebases={'a': {'repository': "", 'branch': 'master'},
                        'b': {'repository': "", 'branch': 'master'}},
             createAbsoluteSourceStamps=True)
-        self.db.state.assertStateByClass('test', 'Nightly',
-                                         last_build=1500 + self.localtime_offset)
         # addBuildsetForChanges calls getCodebase, so this isn't too
         # interesting
         self.assertEqual(self.addBuildsetCallTimes, [300])
@@ -359,17 +330,16 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
                 'properties': None,
                 'reason': u"The Nightly scheduler named 'test' triggered this build",
                 'waited_for': False})])
-        self.db.state.assertStateByClass('test', 'Nightly', lastCodebases={
-            'a': dict(revision='2345:bcd', branch=None, repository='', lastChange=3)})
+        self.db.state.assertStateByClass(
+            'test', 'Nightly', last_build=self.AT_1500, lastCodebases={
+                'a': dict(revision='2345:bcd', branch=None, repository='', lastChange=3)})
         yield self.sched.deactivate()
 
     @defer.inlineCallbacks
     def test_iterations_onlyIfChanged_createAbsoluteSourceStamps_oneChanged_loadOther(self):
         # Test createAbsoluteSourceStamps=True when only one codebase has changed,
         # but the other was previously changed
-        fII = mock.Mock(name='fII')
-        self.makeScheduler(name='test', builderNames=['test'], branch=None,
-                           minute=[5, 25, 45], onlyIfChanged=True,
+        self.makeScheduler(branch=None, minute=[5, 25, 45], onlyIfChanged=True,
                            fileIsImportant=fII,
                            codebases={'a': {'repository': "", 'branch': 'master'},
                                       'b': {'repository': "", 'branch': 'master'}},
@@ -380,11 +350,10 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
             fakedb.ObjectState(objectid=self.OBJECTID, name='lastCodebases',
                                value_json='{"b": {"branch": "master", "repository": "B", "revision": "1234:abc",  "lastChange": 2}}')])
 
-        yield self.do_test_iterations_onlyIfChanged_test(fII,
-                                                         (120, self.makeFakeChange(number=3, codebase='a', revision='2345:bcd'), True))
+        yield self.do_test_iterations_onlyIfChanged_test(
+            (120, self.makeFakeChange(
+                number=3, codebase='a', revision='2345:bcd'), True))
 
-        self.db.state.assertStateByClass('test', 'Nightly',
-                                         last_build=1500 + self.localtime_offset)
         # addBuildsetForChanges calls getCodebase, so this isn't too
         # interesting
         self.assertEqual(self.addBuildsetCallTimes, [300])
@@ -396,9 +365,10 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
                 'properties': None,
                 'reason': u"The Nightly scheduler named 'test' triggered this build",
                 'waited_for': False})])
-        self.db.state.assertStateByClass('test', 'Nightly', lastCodebases={
-            'a': dict(revision='2345:bcd', branch=None, repository='', lastChange=3),
-            'b': dict(revision='1234:abc', branch="master", repository='B', lastChange=2)})
+        self.db.state.assertStateByClass(
+            'test', 'Nightly', last_build=self.AT_1500, lastCodebases={
+                'a': dict(revision='2345:bcd', branch=None, repository='', lastChange=3),
+                'b': dict(revision='1234:abc', branch="master", repository='B', lastChange=2)})
         yield self.sched.deactivate()
 
     @defer.inlineCallbacks
@@ -412,8 +382,6 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
             codebases={'a': {'repository': "", 'branch': 'master'},
                        'b': {'repository': "", 'branch': 'master'}},
             createAbsoluteSourceStamps=True)
-        self.db.state.assertStateByClass('test', 'Nightly',
-                                         last_build=1500 + self.localtime_offset)
         # addBuildsetForChanges calls getCodebase, so this isn't too
         # interesting
         self.assertEqual(self.addBuildsetCallTimes, [300])
@@ -425,7 +393,8 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
                 'properties': None,
                 'reason': u"The Nightly scheduler named 'test' triggered this build",
                 'waited_for': False})])
-        self.db.state.assertStateByClass('test', 'Nightly', lastCodebases={
-            'a': dict(revision='2345:bcd', branch=None, repository='', lastChange=3),
-            'b': dict(revision='1234:abc', branch=None, repository='', lastChange=4)})
+        self.db.state.assertStateByClass(
+            'test', 'Nightly', last_build=self.AT_1500, lastCodebases={
+                'a': dict(revision='2345:bcd', branch=None, repository='', lastChange=3),
+                'b': dict(revision='1234:abc', branch=None, repository='', lastChange=4)})
         yield self.sched.deactivate()
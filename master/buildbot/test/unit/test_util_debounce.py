@@ -246,3 +246,23 @@ class DebounceTest(unittest.TestCase):
             (1, 5.0, 'check'),  # not called
             (1, 6.0, 'called'),
         ])
+
+    def test_reactor_fetched_until_stop(self):
+        """The reactor is only looked up on the first call, and again on the
+        first call after a stop."""
+        reactors = []
+
+        def get_reactor():
+            reactors.append(self.clock)
+            return self.clock
+        db = debounce.Debouncer(4.0, lambda: None, get_reactor)
+        for _ in range(2):
+            db()
+            self.clock.advance(4.0)
+        self.assertEqual(len(reactors), 1)
+
+        db.stop()
+        db.start()
+        db()
+        self.clock.advance(4.0)
+        self.assertEqual(len(reactors), 2)
@@ -45,17 +45,13 @@ class AuthRootResource(www.WwwTestMixin, AuthResourceMixin, unittest.TestCase):
         self.setUpAuthResource()
         self.rsrc = auth.AuthRootResource(self.master)
 
-    def test_getChild_login(self):
-        glr = mock.Mock(name='glr')
-        self.master.www.auth.getLoginResource = glr
-        child = self.rsrc.getChild(b'login', mock.Mock(name='req'))
-        self.assertIdentical(child, glr())
-
-    def test_getChild_logout(self):
-        glr = mock.Mock(name='glr')
-        self.master.www.auth.getLogoutResource = glr
-        child = self.rsrc.getChild(b'logout', mock.Mock(name='req'))
-        self.assertIdentical(child, glr())
+    def test_getChild(self):
+        for path, getter in [(b'login', 'getLoginResource'),
+                             (b'logout', 'getLogoutResource')]:
+            glr = mock.Mock(name=getter)
+            setattr(self.master.www.auth, getter, glr)
+            child = self.rsrc.getChild(path, mock.Mock(name='req'))
+            self.assertIdentical(child, glr())
 
 
 class AuthBase(www.WwwTestMixin, unittest.TestCase):
@@ -45,9 +45,15 @@ class SchedulerMixin(interfaces.InterfaceTests):
 
     OTHER_MASTER_ID = 93
 
-    def setUpScheduler(self):
+    # (actual, fake) function pairs whose signatures are known to match, so
+    # that each pair is only inspected once per test run
+    _matchingBuildsetMethods = set()
+
+    def setUpScheduler(self, wantData=True):
+        # setting up the data API is the most expensive part of the fake
+        # master, so tests that never use it can skip it
         self.master = fakemaster.make_master(testcase=self,
-                                             wantDb=True, wantMq=True, wantData=True)
+                                             wantDb=True, wantMq=True, wantData=wantData)
 
     def tearDownScheduler(self):
         pass
@@ -96,7 +102,11 @@ class SchedulerMixin(interfaces.InterfaceTests):
                 actual = getattr(scheduler, method)
                 fake = getattr(self, 'fake_%s' % method)
 
-                self.assertArgSpecMatches(actual, fake)
+                key = (getattr(actual, '__func__', actual),
+                       getattr(fake, '__func__', fake))
+                if key not in self._matchingBuildsetMethods:
+                    self.assertArgSpecMatches(actual, fake)
+                    self._matchingBuildsetMethods.add(key)
                 setattr(scheduler, method, fake)
             self.addBuildsetCalls = []
             self._bsidGenerator = iter(range(500, 999))
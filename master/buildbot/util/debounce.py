@@ -30,7 +30,7 @@ PH_RUNNING_QUEUED = 3
 
 class Debouncer(object):
     __slots__ = ['phase', 'timer', 'wait', 'function', 'stopped',
-                 'completeDeferreds', 'get_reactor']
+                 'completeDeferreds', 'get_reactor', '_reactor']
 
     def __init__(self, wait, function, get_reactor):
         # time to wait
@@ -47,13 +47,17 @@ class Debouncer(object):
         self.completeDeferreds = None
         # for tests
         self.get_reactor = get_reactor
+        # reactor from get_reactor, kept until the next stop
+        self._reactor = None
 
     def __call__(self):
         if self.stopped:
             return
         phase = self.phase
         if phase == PH_IDLE:
-            self.timer = self.get_reactor().callLater(self.wait, self.invoke)
+            if self._reactor is None:
+                self._reactor = self.get_reactor()
+            self.timer = self._reactor.callLater(self.wait, self.invoke)
             self.phase = PH_WAITING
         elif phase == PH_RUNNING:
             self.phase = PH_RUNNING_QUEUED
@@ -74,8 +78,10 @@ class Debouncer(object):
         def retry(_):
             queued = self.phase == PH_RUNNING_QUEUED
             self.phase = PH_IDLE
-            while self.completeDeferreds:
-                self.completeDeferreds.pop(0).callback(None)
+            completeDeferreds, self.completeDeferreds = \
+                self.completeDeferreds, []
+            for d in completeDeferreds:
+                d.callback(None)
             if queued:
                 self.__call__()
 
@@ -84,6 +90,7 @@ class Debouncer(object):
 
     def stop(self):
         self.stopped = True
+        self._reactor = None
         if self.phase == PH_WAITING:
             self.timer.cancel()
             self.invoke()
@@ -104,10 +111,9 @@ class _Descriptor(object):
         self.get_reactor = get_reactor
 
     def __get__(self, instance, cls):
-        try:
-            db = getattr(instance, self.attrName)
-        except AttributeError:
-            db = Debouncer(self.wait, functools.partial(self.fn, instance),
+        db = instance.__dict__.get(self.attrName)
+        if db is None:
+            db = Debouncer(self.wait, self.fn.__get__(instance, cls),
                            functools.partial(self.get_reactor, instance))
             setattr(instance, self.attrName, db)
         return db
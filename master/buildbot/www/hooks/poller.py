@@ -28,12 +28,13 @@ class PollingHandler(BaseHookHandler):
     def getChanges(self, req):
         change_svc = req.site.master.change_svc
         poll_all = "poller" not in req.args
+        requested = set() if poll_all else set(req.args['poller'])
 
         allow_all = True
-        allowed = []
+        allowed = set()
         if isinstance(self.options, dict) and "allowed" in self.options:
             allow_all = False
-            allowed = self.options["allowed"]
+            allowed = set(self.options["allowed"])
 
         pollers = []
 
@@ -42,14 +43,14 @@ class PollingHandler(BaseHookHandler):
                 continue
             if not hasattr(source, "name"):
                 continue
-            if not poll_all and source.name not in req.args['poller']:
+            if not poll_all and source.name not in requested:
                 continue
             if not allow_all and source.name not in allowed:
                 continue
             pollers.append(source)
 
         if not poll_all:
-            missing = set(req.args['poller']) - set(s.name for s in pollers)
+            missing = requested.difference(s.name for s in pollers)
             if missing:
                 raise ValueError("Could not find pollers: %s" % ",".join(missing))
 